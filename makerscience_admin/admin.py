@@ -4,6 +4,8 @@ from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.contrib.admin.options import ModelAdmin
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.utils.html import format_html
 from django import forms
 
 from mptt.admin import MPTTModelAdmin
@@ -19,9 +21,11 @@ from makerscience_profile.models import MakerScienceProfile
 from makerscience_catalog.models import MakerScienceProject, MakerScienceResource
 from makerscience_forum.models import MakerSciencePost
 from accounts.models import Profile, ObjectProfileLink
-from .models import MakerScienceStaticContent, PageViews
+from .models import MakerScienceStaticContent, PageViews, PageViewsCounter, ProfiledRequest
+from .prefetch import prefetch_related_per_model
 from simple_history.admin import SimpleHistoryAdmin
 
+
 # admin_registry = admin.site._registry.copy()
 # for model, model_admin in admin_registry.iteritems():
 #     admin.site.unregister(model)
@@ -72,7 +76,53 @@ class ObjectProfileLinkLevelFilter(SimpleListFilter):
             return queryset.filter(level=self.value())
         return queryset
 
-class ObjectProfileLinkAdmin(admin.ModelAdmin):
+class PrefetchingChangeListMixin(object):
+    def get_results(self, request):
+        super(PrefetchingChangeListMixin, self).get_results(request)
+        # The page queryset is evaluated once, list() returns its cached instances
+        self.model_admin.prefetch_page(list(self.result_list))
+
+
+class PrefetchingModelAdminMixin(object):
+    """
+    Let the list columns of a changelist page be rendered from data fetched in bulk by prefetch_page
+    """
+    def get_changelist(self, request, **kwargs):
+        changelist_class = super(PrefetchingModelAdminMixin, self).get_changelist(request, **kwargs)
+        return type('Prefetching%s' % changelist_class.__name__, (PrefetchingChangeListMixin, changelist_class), {})
+
+    def prefetch_page(self, objects):
+        pass
+
+
+def map_root_posts(posts):
+    """
+    Return the root of each post, keyed by tree id, with one query
+    """
+    roots = Post.objects.filter(tree_id__in=set(post.tree_id for post in posts), level=0)
+    return dict((root.tree_id, root) for root in roots)
+
+
+class ObjectProfileLinkAdmin(PrefetchingModelAdminMixin, admin.ModelAdmin):
+    CONTENT_OBJECT_LOOKUPS = {
+        MakerScienceProject : ['parent'],
+        MakerScienceResource : ['parent'],
+        MakerSciencePost : ['parent'],
+        MakerScienceProfile : ['parent__user'],
+        TaggedItem : ['tag', 'content_object'],
+    }
+
+    def get_queryset(self, request):
+        return super(ObjectProfileLinkAdmin, self).get_queryset(request).select_related('profile__user', 'content_type')\
+                                                                        .prefetch_related('content_object')
+
+    def prefetch_page(self, links):
+        objects_by_model = prefetch_related_per_model([link.content_object for link in links], self.CONTENT_OBJECT_LOOKUPS)
+        roots = map_root_posts(objects_by_model.get(Post, []))
+        for link in links:
+            if isinstance(link.content_object, Post):
+                link.root_post = roots.get(link.content_object.tree_id)
+
     def display_level(self, obj):
         return "%s - %s" % (obj.level, dict(settings.OBJECTPROFILELINK_CHOICES)[obj.level])
     display_level.short_description = 'Type de relation'
@@ -82,22 +132,23 @@ class ObjectProfileLinkAdmin(admin.ModelAdmin):
     display_profile.short_description = 'Profile'
 
     def display_content_object(self, obj):
-        if obj.content_type.model == 'makerscienceproject' and MakerScienceProject.objects.filter(parent=obj.content_object).exists():
-            return 'Projet : %s' % obj.content_object.parent.title
-        if obj.content_type.model == 'makerscienceproject' and MakerScienceProject.objects.filter(id=obj.content_object.id).exists():
-            return 'Projet : %s' % obj.content_object.parent.title
-        elif obj.content_type.model == 'makerscienceresource' and MakerScienceResource.objects.filter(id=obj.object_id).exists():
-            return 'Experience : %s' % obj.content_object.parent.title
-        elif obj.content_type.model == 'makersciencepost' and MakerSciencePost.objects.filter(parent=obj.content_object).exists():
-            return "Discussion : %s" % obj.content_object.title
-        elif obj.content_type.model == 'post' and Post.objects.filter(id=obj.object_id).exists():
-            return "Réponse à la discussion : %s" % obj.content_object.get_root()
-        elif obj.content_type.model == 'makerscienceprofile' and MakerScienceProfile.objects.filter(id=obj.content_object.id).exists():
-            return "%s (#%s)" % (obj.content_object.parent.get_full_name_or_username().title(), obj.object_id)
-        elif obj.content_type.model == 'tag' and Tag.objects.filter(id=obj.content_object.id).exists():
-            return "Tag %s" % obj.content_object.slug
-        elif obj.content_type.model == 'taggeditem' and TaggedItem.objects.filter(id=obj.content_object.id).exists():
-            return "Tag %s sur %s" % (obj.content_object.tag.slug, obj.content_object.content_object)
+        content_object = obj.content_object
+        if content_object is None:
+            return "Inconnu : %s %s" % (obj.content_type, obj.object_id)
+        if obj.content_type.model == 'makerscienceproject':
+            return 'Projet : %s' % content_object.parent.title
+        elif obj.content_type.model == 'makerscienceresource':
+            return 'Experience : %s' % content_object.parent.title
+        elif obj.content_type.model == 'makersciencepost':
+            return "Discussion : %s" % content_object.parent.title
+        elif obj.content_type.model == 'post':
+            return "Réponse à la discussion : %s" % (getattr(obj, 'root_post', None) or content_object.get_root())
+        elif obj.content_type.model == 'makerscienceprofile':
+            return "%s (#%s)" % (content_object.parent.get_full_name_or_username().title(), obj.object_id)
+        elif obj.content_type.model == 'tag':
+            return "Tag %s" % content_object.slug
+        elif obj.content_type.model == 'taggeditem':
+            return "Tag %s sur %s" % (content_object.tag.slug, content_object.content_object)
         return "Inconnu : %s %s" % (obj.content_type, obj.object_id)
     display_content_object.short_description = 'Contenu lié'
 
@@ -123,20 +174,50 @@ class PageViewsAdmin(admin.ModelAdmin):
 
 admin.site.register(PageViews, PageViewsAdmin)
 
+class PageViewsCounterAdmin(admin.ModelAdmin):
+    list_display = ('resource_uri', 'total', 'unique_visitors')
+    search_fields = ('resource_uri',)
+    exclude = ('sketch',)
+
+admin.site.register(PageViewsCounter, PageViewsCounterAdmin)
+
+
+class ProfiledRequestAdmin(admin.ModelAdmin):
+    def display_top_functions(self, obj):
+        return format_html('<pre>{0}</pre>', obj.top_functions)
+    display_top_functions.short_description = 'Fonctions les plus coûteuses'
+
+    list_display = ('created_on', 'method', 'path', 'user', 'duration')
+    list_filter = ('method',)
+    search_fields = ('path', 'request_id')
+    readonly_fields = ('request_id', 'method', 'path', 'user', 'duration', 'created_on',
+                       'pstats_file', 'collapsed_file', 'display_top_functions')
+    exclude = ('top_functions',)
+
+    def has_add_permission(self, request):
+        return False
+
+admin.site.register(ProfiledRequest, ProfiledRequestAdmin)
+
+
+class PostAdmin(PrefetchingModelAdminMixin, MPTTModelAdmin):
+    def prefetch_page(self, posts):
+        answers = dict((post.id, post) for post in posts if not post.is_root_node())
+        authoring_links = ObjectProfileLink.objects.filter(content_type=ContentType.objects.get_for_model(Post),
+                                                           object_id__in=answers.keys(),
+                                                           level=30).select_related('profile__user')
+        for link in authoring_links:
+            answers[link.object_id].author = link.profile
 
-class PostAdmin(MPTTModelAdmin):
     def display_smart_title(self, obj):
         if obj.is_root_node():
             return obj.title
-        else:
-            try:
-                author = ObjectProfileLink.objects.get(content_type__model='post', object_id=obj.id, level=30).profile
-                if obj.level == 1:
-                    return "-- Réponse de : %s" % author
-                elif obj.level == 2:
-                    return "---- Commentaire de : %s" % author
-            except:
-                pass
+        author = getattr(obj, 'author', None)
+        if author is not None:
+            if obj.level == 1:
+                return "-- Réponse de : %s" % author
+            elif obj.level == 2:
+                return "---- Commentaire de : %s" % author
         return ""
 
     display_smart_title.short_description = 'Titre'
@@ -148,24 +229,43 @@ class PostAdmin(MPTTModelAdmin):
 admin.site.register(Post, PostAdmin)
 
 
+def exists_related_sql(model, field_name, outer_model):
+    """
+    SQL telling if a row of model references the current row of outer_model through field_name
+    """
+    return "EXISTS (SELECT 1 FROM %s WHERE %s.%s = %s.%s)" % (model._meta.db_table,
+                                                             model._meta.db_table, model._meta.get_field(field_name).column,
+                                                             outer_model._meta.db_table, outer_model._meta.pk.column)
+
+
 class ProjectAdmin(SimpleHistoryAdmin):
+    def get_queryset(self, request):
+        return super(ProjectAdmin, self).get_queryset(request).extra(select={
+            'with_projectsheet' : exists_related_sql(ProjectSheet, 'project', Project),
+            'with_makerscienceproject' : exists_related_sql(MakerScienceProject, 'parent', Project),
+            'with_makerscienceresource' : exists_related_sql(MakerScienceResource, 'parent', Project),
+        })
+
     def has_projectsheet(self, obj):
-        return ProjectSheet.objects.filter(project=obj).exists()
+        return obj.with_projectsheet
 
     has_projectsheet.short_description = 'Lié à un fiche ?'
     has_projectsheet.boolean = True
+    has_projectsheet.admin_order_field = 'with_projectsheet'
 
     def is_makerscienceproject(self, obj):
-        return MakerScienceProject.objects.filter(parent=obj).exists()
+        return obj.with_makerscienceproject
 
     is_makerscienceproject.short_description = 'Est un projet ?'
     is_makerscienceproject.boolean = True
+    is_makerscienceproject.admin_order_field = 'with_makerscienceproject'
 
     def is_makerscienceresource(self, obj):
-        return MakerScienceResource.objects.filter(parent=obj).exists()
+        return obj.with_makerscienceresource
 
     is_makerscienceresource.short_description = 'Est une expérience ?'
     is_makerscienceresource.boolean = True
+    is_makerscienceresource.admin_order_field = 'with_makerscienceresource'
 
 
     list_display = ["title", 'has_projectsheet', 'is_makerscienceproject', 'is_makerscienceresource']
@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.db.models import Q, Count
 from django.utils.text import slugify
 from tastypie.resources import ModelResource
 from tastypie import fields
 from tastypie.paginator import Paginator
+from tastypie.exceptions import BadRequest
 from haystack.query import SQ
 
 from haystack.query import SearchQuerySet
@@ -10,10 +14,89 @@ from haystack.inputs import Raw
 from graffiti.api import TagResource
 
 
-from .models import MakerScienceStaticContent
+from makerscience_catalog.models import MakerScienceProjectTaggedItem, MakerScienceResourceTaggedItem
+
+from .models import MakerScienceStaticContent, get_pageviews_count, static_content_cache_key, STATIC_CONTENT_CACHE_TIMEOUT
+from .metrics import count_cache_lookups
+
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from urllib import urlencode
 
 import json
 
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def encode_cursor(date, pk):
+    return urlsafe_b64encode("%s|%s" % (date.strftime(CURSOR_DATE_FORMAT), pk))
+
+def decode_cursor(cursor):
+    """
+    Return the (date, id) position encoded in cursor, or None if it is not a valid cursor
+    """
+    try:
+        date, pk = urlsafe_b64decode(str(cursor)).rsplit('|', 1)
+        return datetime.strptime(date, CURSOR_DATE_FORMAT), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+def keyset_page(queryset, cursor, limit, date_field='created_on'):
+    """
+    Fetch one page of queryset, newest first on (date_field, id), starting after cursor.
+    Only limit + 1 rows are read, the extra one telling if there is a next page.
+    Return the page and the cursor of the next page (None on the last one).
+    """
+    queryset = queryset.order_by('-%s' % date_field, '-id')
+
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        date, pk = position
+        queryset = queryset.filter(Q(**{'%s__lt' % date_field : date}) | Q(**{date_field : date, 'id__lt' : pk}))
+
+    page = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(getattr(page[-1], date_field), page[-1].id)
+    return page, next_cursor
+
+class KeysetPaginator(Paginator):
+    """
+    Tastypie paginator walking the objects newest first with the cursor of
+    keyset_page instead of an offset, set date_field in subclasses.
+    The page size is bounded by max_limit, limit=0 included.
+    """
+    date_field = 'created_on'
+
+    def get_limit(self):
+        try:
+            limit = int(self.request_data.get('limit', self.limit))
+        except (TypeError, ValueError):
+            raise BadRequest("Invalid limit '%s' provided. Please provide a positive integer." % self.request_data.get('limit'))
+        if limit <= 0 or (self.max_limit and limit > self.max_limit):
+            return self.max_limit
+        return limit
+
+    def get_next_uri(self, limit, cursor):
+        if cursor is None or self.resource_uri is None:
+            return None
+        request_params = dict((key, value) for key, value in self.request_data.items() if key not in ('offset', 'cursor'))
+        request_params.update({'limit' : limit, 'cursor' : cursor})
+        return '%s?%s' % (self.resource_uri, urlencode(request_params))
+
+    def page(self):
+        limit = self.get_limit()
+        objects, next_cursor = keyset_page(self.objects, self.request_data.get('cursor'), limit, self.date_field)
+        return {
+            self.collection_name : objects,
+            'meta' : {
+                'limit' : limit,
+                'next' : self.get_next_uri(limit, next_cursor),
+                'cursor' : next_cursor,
+            },
+        }
+
+
 class MakerScienceStaticContentResource(ModelResource):
     project_thematic_selection = fields.ToManyField(TagResource, 'project_thematic_selection', full=True, null=True, readonly=True)
     resource_thematic_selection = fields.ToManyField(TagResource, 'resource_thematic_selection', full=True, null=True, readonly=True)
@@ -24,6 +107,51 @@ class MakerScienceStaticContentResource(ModelResource):
         resource_name = 'makerscience/static'
         always_return_data = True
 
+    def get_static_content(self, request):
+        """
+        Return the static content with the object count of each selected tag, cached until the content changes
+        """
+        cache_key = static_content_cache_key()
+        data = cache.get(cache_key)
+        count_cache_lookups('static_content', int(data is not None), int(data is None))
+        if data is None:
+            bundle = self.full_dehydrate(self.build_bundle(obj=MakerScienceStaticContent.get_solo(), request=request))
+            data = self._meta.serializer.to_simple(bundle, {})
+            for selection, tagged_item_model in (('project_thematic_selection', MakerScienceProjectTaggedItem),
+                                                 ('resource_thematic_selection', MakerScienceResourceTaggedItem)):
+                counts = dict(tagged_item_model.objects.filter(tag__in=[tag['id'] for tag in data[selection]])
+                                                       .values_list('tag')
+                                                       .annotate(count=Count('object_id', distinct=True)))
+                for tag in data[selection]:
+                    tag['objects_count'] = counts.get(int(tag['id']), 0)
+            cache.set(cache_key, data, STATIC_CONTENT_CACHE_TIMEOUT)
+        return data
+
+    def get_list(self, request, **kwargs):
+        return self.create_response(request, {
+            'meta' : {'limit' : 1, 'offset' : 0, 'next' : None, 'previous' : None, 'total_count' : 1},
+            'objects' : [self.get_static_content(request)],
+        })
+
+    def get_detail(self, request, **kwargs):
+        return self.create_response(request, self.get_static_content(request))
+
+
+class PageViewsCounterResource(object):
+    """
+    Add the pageviews counter to the single object lists of the resources in PAGEVIEWS_FILTER,
+    and mark the view for PageViewsMiddleware. Must come before ModelResource in the bases.
+    """
+    def alter_list_data_to_serialize(self, request, data):
+        data = super(PageViewsCounterResource, self).alter_list_data_to_serialize(request, data)
+        if request.method == 'GET' and self._meta.resource_name in settings.PAGEVIEWS_FILTER:
+            objects = data.get(self._meta.collection_name)
+            if objects and len(objects) == 1:
+                resource_uri = objects[0].data['resource_uri']
+                request.pageviews_resource_uri = resource_uri
+                objects[0].data['pageviews_counter'] = get_pageviews_count(resource_uri)
+        return data
+
 
 class SearchableMakerScienceResource(object):
 
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+The unread counts, live notification stamps, static content version, profile
+summaries and activity fragments are written by the worker commands and read by
+every web process, the default cache must be shared by all of them (memcached, redis).
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+LOCAL_CACHE_ALLOWED = getattr(settings, 'LOCAL_CACHE_ALLOWED', False) # single process development setups
+
+def is_shared_cache():
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+def check_shared_cache():
+    if not is_shared_cache() and not LOCAL_CACHE_ALLOWED:
+        raise ImproperlyConfigured("The default cache (%s) is local to each process, the web processes would serve "
+                                   "stale data written by the workers. Configure a shared cache in CACHES, "
+                                   "or set LOCAL_CACHE_ALLOWED for a single process setup."
+                                   % settings.CACHES['default']['BACKEND'])
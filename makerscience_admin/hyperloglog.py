@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+HyperLogLog sketch estimating the number of distinct values added,
+with 2 ** precision one-byte registers (1 KB, about 3% error by default)
+"""
+from base64 import b64encode, b64decode
+
+import hashlib
+import math
+
+HLL_PRECISION = 10
+
+
+class HyperLogLog(object):
+
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+
+    @classmethod
+    def from_string(cls, value, precision=HLL_PRECISION):
+        return cls(b64decode(value) if value else None, precision)
+
+    def to_string(self):
+        return b64encode(str(self.registers))
+
+    def add(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        hashed = int(hashlib.sha1(value).hexdigest()[:16], 16) # 64 bits
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rank = remaining_bits - (hashed & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        for index, rank in enumerate(other.registers):
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -rank for rank in self.registers)
+        empty_registers = sum(1 for rank in self.registers if rank == 0)
+        if estimate <= 2.5 * self.size and empty_registers:
+            # Small range correction
+            estimate = self.size * math.log(float(self.size) / empty_registers)
+        return int(round(estimate))
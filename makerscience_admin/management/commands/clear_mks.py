@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from django.db.models import Q
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q, F
 from optparse import make_option
 from accounts.models import ObjectProfileLink
 from scout.models import Place
@@ -12,52 +13,99 @@ from taggit.models import TaggedItem
 class Command(BaseCommand):
     help = "Clear MakerScience"
 
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help='Only count what would be cleared'),
+        make_option('--chunk-size', '-c',
+                    dest='chunk_size',
+                    type='int',
+                    default=500,
+                    help='Number of rows deleted at once'),
+    )
+
+    def delete_in_chunks(self, queryset, label):
+        ids = list(queryset.values_list('id', flat=True))
+        print "%s : %s to delete" % (label, len(ids))
+        if self.dry_run:
+            return
+        for start in range(0, len(ids), self.chunk_size):
+            queryset.model.objects.filter(id__in=ids[start:start + self.chunk_size]).delete()
+            print "    %s/%s" % (min(start + self.chunk_size, len(ids)), len(ids))
+
+    def delete_orphans(self, model, label):
+        """
+        Delete the rows of a model with a generic relation whose object no longer exists,
+        with one anti-join per content type
+        """
+        content_type_ids = model.objects.order_by().values_list('content_type', flat=True).distinct()
+        for content_type in ContentType.objects.filter(id__in=list(content_type_ids)):
+            object_class = content_type.model_class()
+            orphans = model.objects.filter(content_type=content_type)
+            if object_class is not None:
+                orphans = orphans.exclude(object_id__in=object_class._base_manager.values('pk'))
+            self.delete_in_chunks(orphans, "%s on %s" % (label, content_type.model))
+
     def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.chunk_size = options['chunk_size']
 
         # in some obscure cases, content_object become None and crash
-        print "Clearing ObjectProfileLink ...",
-        for o in ObjectProfileLink.objects.all():
-            if o.content_object == None or o.profile == None:
-                o.delete()
+        print "Clearing ObjectProfileLink ..."
+        self.delete_orphans(ObjectProfileLink, "ObjectProfileLink")
+        self.delete_in_chunks(ObjectProfileLink.objects.filter(profile__isnull=True), "Profile-less ObjectProfileLink")
         print "[OK]"
 
         print "Clearing ProjectSheet bucket ...",
-        for p in ProjectSheet.objects.all():
-            if p.bucket == None:
+        sheets = ProjectSheet.objects.filter(bucket__isnull=True)
+        print "%s to fix" % sheets.count()
+        if not self.dry_run:
+            for p in sheets:
                 #will raise signal pre_save createProjectSheetBucket on projectsheet (defined in dataserver.projectsheet.models)
                 p.save()
         print "[OK]"
 
         print "Clearing MakerScienceProfile website ...",
-        for p in MakerScienceProfile.objects.exclude(Q(website__startswith="http://") | Q(website__startswith="https://"))\
-                                            .exclude(Q(website__isnull=True) | Q(website="")):
+        profiles = MakerScienceProfile.objects.exclude(Q(website__startswith="http://") | Q(website__startswith="https://"))\
+                                              .exclude(Q(website__isnull=True) | Q(website=""))
+        print "%s to fix" % profiles.count()
+        if not self.dry_run:
+            for p in profiles:
                 p.website = "http://"+p.website
                 p.save()
         print "[OK]"
 
         print "Clearing Project website ...",
-        for p in Project.objects.exclude(Q(website__startswith="http://") | Q(website__startswith="https://"))\
-                                            .exclude(Q(website__isnull=True) | Q(website="")):
+        projects = Project.objects.exclude(Q(website__startswith="http://") | Q(website__startswith="https://"))\
+                                  .exclude(Q(website__isnull=True) | Q(website=""))
+        print "%s to fix" % projects.count()
+        if not self.dry_run:
+            for p in projects:
                 p.website = "http://"+p.website
                 p.save()
         print "[OK]"
 
-        print "Clearing Place ...",
-        for p in Place.objects.all():
-            if p.makerscienceprofile_set.count() == 0 and p.project_set.count() == 0:
-                p.delete()
-            else:
+        print "Clearing Place ..."
+        self.delete_in_chunks(Place.objects.filter(makerscienceprofile__isnull=True, project__isnull=True), "Unused Place")
+        # Saving the address geocodes it, only the places not located yet need it
+        places = Place.objects.filter(geo__isnull=True, address__isnull=False).select_related('address')
+        print "Place to geocode : %s" % places.count()
+        if not self.dry_run:
+            for p in places:
                 p.address.save()
         print "[OK]"
 
-        print "Clearing orphan TaggedItem ...",
-        for t in TaggedItem.objects.all():
-            if t.content_object == None or  t.tag == None:
-                t.delete()
+        print "Clearing orphan TaggedItem ..."
+        self.delete_orphans(TaggedItem, "TaggedItem")
+        self.delete_in_chunks(TaggedItem.objects.filter(tag__isnull=True), "Tag-less TaggedItem")
         print "[OK]"
 
         print "Clearing text-less post ...",
-        for p in Post.objects.filter(text='', title__isnull=False):
-            p.text = p.title
-            p.save()
+        posts = Post.objects.filter(text='', title__isnull=False)
+        if self.dry_run:
+            print "%s to fix" % posts.count()
+        else:
+            print "%s fixed" % posts.update(text=F('title'))
         print "[OK]"
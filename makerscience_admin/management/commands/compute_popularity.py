@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from makerscience_admin.models import compute_popularity
+
+class Command(BaseCommand):
+    help = "Update the time-decayed popularity of projects, resources and discussions, to be run periodically " \
+           "before update_index so that search results can be ordered by popularity too."
+
+    def handle(self, *args, **options):
+        print "Computing popularity ...",
+        updated = compute_popularity()
+        print "[OK] %s object(s) updated" % updated
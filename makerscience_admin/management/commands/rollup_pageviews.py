@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.core.cache import cache
+from django.db import transaction
+from optparse import make_option
+
+from makerscience_admin.models import PageViews, PageViewsCounter, PageViewsDay, pageviews_cache_key, create_missing
+
+from datetime import date, timedelta
+
+class Command(BaseCommand):
+    help = "Move the raw PageViews rows into the aggregated counters, and prune the old per-day counters."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--prune-days',
+                    dest='prune_days',
+                    type='int',
+                    default=None,
+                    help='Delete the per-day counters older than this number of days'),
+    )
+
+    def handle(self, *args, **options):
+        resource_uris = list(PageViews.objects.order_by().values_list('resource_uri', flat=True).distinct())
+        print "Rolling up the raw views of %s resource(s) ..." % len(resource_uris),
+        for resource_uri in resource_uris:
+            create_missing(PageViewsCounter, resource_uri=resource_uri)
+            # Raw rows are deleted with their rollup, running the command again does not count them twice
+            with transaction.atomic():
+                counter = PageViewsCounter.objects.select_for_update().get(resource_uri=resource_uri)
+                raw_views = PageViews.objects.filter(resource_uri=resource_uri)
+                counter.add_clients(list(raw_views.values_list('client', flat=True)))
+                counter.save()
+                raw_views.delete()
+            cache.delete(pageviews_cache_key(resource_uri))
+        print "[OK]"
+
+        if options['prune_days'] is not None:
+            print "Pruning per-day counters ...",
+            PageViewsDay.objects.filter(day__lt=date.today() - timedelta(days=options['prune_days'])).delete()
+            print "[OK]"
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal metrics registry rendered in the Prometheus text format by the metrics view.
+
+Counters and histograms are aggregated across the processes in the shared
+cache (see makerscience_admin.caching): each process adds up its increments
+in memory and adds them to the cache every METRICS_FLUSH_INTERVAL seconds,
+and when rendering. Whichever worker answers /metrics/ renders the totals of
+all the processes. Counted values are integers, histogram sums are kept in
+microseconds. Gauges are computed when rendered.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from collections import defaultdict
+
+import atexit
+import hashlib
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 10) # seconds
+METRICS_CACHE_PREFIX = 'metrics'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in sorted(labels.items()):
+        value = unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(u'%s="%s"' % (name, value))
+    return u'{%s}' % u','.join(escaped)
+
+def shared_incr(key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # First increment, or the value was evicted
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+class Metric(object):
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def label_values(self, labels):
+        # Unicode values, the keys of the cache must not depend on the type of the string
+        return tuple(unicode(labels.get(label, '')) for label in self.labels)
+
+    def render(self):
+        lines = [u'# HELP %s %s' % (self.name, self.help), u'# TYPE %s %s' % (self.name, self.kind)]
+        for name, labels, value in self.samples():
+            lines.append(u'%s%s %s' % (name, format_labels(labels), repr(float(value))))
+        return lines
+
+    def flush(self):
+        pass
+
+
+class SharedMetric(Metric):
+    """
+    Metric whose values are added up in the cache, under one key per label values
+    and field. The label values seen by all the processes are listed in an index key.
+    """
+
+    def __init__(self, name, help, labels=()):
+        super(SharedMetric, self).__init__(name, help, labels)
+        self.pending = {}
+        self.known = set()
+
+    def index_key(self):
+        return '%s:%s:labels' % (METRICS_CACHE_PREFIX, self.name)
+
+    def value_key(self, label_values, field):
+        return '%s:%s:%s:%s' % (METRICS_CACHE_PREFIX, self.name, hashlib.md5(repr(label_values)).hexdigest(), field)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.known.update(pending)
+        for label_values, deltas in pending.items():
+            for field, delta in deltas.items():
+                shared_incr(self.value_key(label_values, field), delta)
+        # Concurrent updates of the index may drop label values, they are added back by the next flush
+        index = cache.get(self.index_key()) or []
+        missing = self.known.difference(index)
+        if missing:
+            cache.set(self.index_key(), index + sorted(missing), None)
+
+    def shared_values(self, fields):
+        """
+        Return the (label values, {field : total}) pairs of all the processes
+        """
+        index = cache.get(self.index_key()) or []
+        keys = dict(((label_values, field), self.value_key(label_values, field)) for label_values in index for field in fields)
+        totals = cache.get_many(keys.values())
+        for label_values in index:
+            yield label_values, dict((field, totals.get(keys[label_values, field], 0)) for field in fields)
+
+
+class Counter(SharedMetric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            deltas = self.pending.setdefault(self.label_values(labels), defaultdict(int))
+            deltas['value'] += int(amount)
+        registry.flush_due()
+
+    def samples(self):
+        for label_values, totals in self.shared_values(('value',)):
+            yield self.name, dict(zip(self.labels, label_values)), totals['value']
+
+
+class Histogram(SharedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def fields(self):
+        return range(len(self.buckets) + 1) + ['sum']
+
+    def observe(self, value, **labels):
+        with self.lock:
+            deltas = self.pending.setdefault(self.label_values(labels), defaultdict(int))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    deltas[index] += 1
+                    break
+            else:
+                deltas[len(self.buckets)] += 1
+            deltas['sum'] += int(value * 1000000)
+        registry.flush_due()
+
+    def samples(self):
+        for label_values, totals in self.shared_values(self.fields()):
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for index, bound in enumerate(self.buckets + ('+Inf',)):
+                cumulative += totals[index]
+                yield '%s_bucket' % self.name, dict(labels, le=bound), cumulative
+            yield '%s_sum' % self.name, labels, totals['sum'] / 1000000.0
+            yield '%s_count' % self.name, labels, cumulative
+
+
+class Gauge(Metric):
+    """
+    Gauge whose samples are returned by collect, a callable giving (labels, value) pairs
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect):
+        super(Gauge, self).__init__(name, help)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, labels, value
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+        self.flushed_on = time.time()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def flush(self):
+        self.flushed_on = time.time()
+        for metric in self.metrics:
+            metric.flush()
+
+    def flush_due(self):
+        if time.time() - self.flushed_on < METRICS_FLUSH_INTERVAL:
+            return
+        # A single thread of the process flushes, the others keep counting
+        if self.lock.acquire(False):
+            try:
+                self.flush()
+            finally:
+                self.lock.release()
+
+    def render(self):
+        with self.lock:
+            self.flush()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return u'\n'.join(lines) + u'\n'
+
+
+registry = Registry()
+# The increments of the last seconds of the commands and workers
+atexit.register(registry.flush)
+
+request_duration = registry.register(Histogram('makerscience_request_duration_seconds',
+                                               'Time spent serving the API requests',
+                                               labels=('resource', 'method')))
+request_errors = registry.register(Counter('makerscience_request_errors_total',
+                                           'API requests answered with a server error',
+                                           labels=('resource', 'method', 'status')))
+cache_hits = registry.register(Counter('makerscience_cache_hits_total',
+                                       'Cached values found',
+                                       labels=('cache',)))
+cache_misses = registry.register(Counter('makerscience_cache_misses_total',
+                                         'Cached values computed again',
+                                         labels=('cache',)))
+
+def count_cache_lookups(cache_name, hits, misses):
+    if hits:
+        cache_hits.inc(hits, cache=cache_name)
+    if misses:
+        cache_misses.inc(misses, cache=cache_name)
@@ -1,54 +1,199 @@
 from django.conf import settings
-from django.http import HttpResponse
-from django.core.urlresolvers import resolve
+from django.core.handlers.base import BaseHandler
+from django.db import connection
 
-from .models import PageViews
+from .models import record_pageviews, ProfiledRequest
+from .profiler import save_profile
+from .sqlstats import QueryStats, query_budget
+from .metrics import request_duration, request_errors
 
-from ipware.ip import get_real_ip, get_ip
+from ipware.ip import get_ip
 
-import json
+import atexit
+import cProfile
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+PAGEVIEWS_FLUSH_INTERVAL = getattr(settings, 'PAGEVIEWS_FLUSH_INTERVAL', 30) # seconds
+PAGEVIEWS_BUFFER_SIZE = getattr(settings, 'PAGEVIEWS_BUFFER_SIZE', 500)
+PAGEVIEWS_BUFFER_MAX_SIZE = getattr(settings, 'PAGEVIEWS_BUFFER_MAX_SIZE', 10 * PAGEVIEWS_BUFFER_SIZE)
+SQL_INSTRUMENTATION = getattr(settings, 'SQL_INSTRUMENTATION', settings.DEBUG)
+SQL_INSTRUMENTATION_SAMPLE_RATE = getattr(settings, 'SQL_INSTRUMENTATION_SAMPLE_RATE', 1.0) # share of the requests instrumented
+SQL_INSTRUMENTATION_HEADERS = getattr(settings, 'SQL_INSTRUMENTATION_HEADERS', settings.DEBUG)
+
+PROFILER_DIR = getattr(settings, 'PROFILER_DIR', os.path.join(tempfile.gettempdir(), 'makerscience_profiles'))
+
+sql_logger = logging.getLogger('makerscience.sql')
+pageviews_logger = logging.getLogger('makerscience.pageviews')
+
+
+class PageViewsBuffer(object):
+    """
+    Page views waiting to be added to the counters, flushed by a background thread
+    every PAGEVIEWS_FLUSH_INTERVAL seconds, or as soon as PAGEVIEWS_BUFFER_SIZE views are waiting.
+    Requests only append to the buffer.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = []
+        self.wakeup = threading.Event()
+        self.pid = None
+
+    def add(self, client, resource_uri):
+        with self.lock:
+            self.views.append((client, resource_uri))
+            self.start_flushing()
+            full = len(self.views) >= PAGEVIEWS_BUFFER_SIZE
+        if full:
+            self.wakeup.set()
+
+    def start_flushing(self):
+        # Started on first use in each process, forked workers do not inherit the thread
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            thread = threading.Thread(target=self.run, name='pageviews-flush')
+            thread.daemon = True
+            thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(PAGEVIEWS_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+            # The thread connection is not closed by the request handlers
+            connection.close()
+
+    def flush(self):
+        with self.lock:
+            views, self.views = self.views, []
+        if not views:
+            return
+        try:
+            record_pageviews(views)
+        except Exception:
+            pageviews_logger.exception("Could not record %s page views, retrying on the next flush", len(views))
+            with self.lock:
+                # The oldest views are dropped if the database stays unavailable
+                self.views = (views + self.views)[-PAGEVIEWS_BUFFER_MAX_SIZE:]
+
+pageviews_buffer = PageViewsBuffer()
+atexit.register(pageviews_buffer.flush)
 
 
 class PageViewsMiddleware(object):
+    """
+    Record the views marked by PageViewsCounterResource, the response is left untouched
+    """
+    def process_response(self, request, response):
+        resource_uri = getattr(request, 'pageviews_resource_uri', None)
+        if resource_uri and response.status_code == 200:
+            if request.user.is_authenticated():
+                client = request.user.username
+            else:
+                client = get_ip(request)
+            pageviews_buffer.add(client, resource_uri)
+        return response
+
+
+class SQLInstrumentationMiddleware(object):
+    """
+    Record the queries of each request. Outside production (SQL_INSTRUMENTATION_HEADERS)
+    their count, time and duplicates are sent as X-SQL-* headers, and requests going over
+    the SQL_QUERY_BUDGETS of their resource are logged. Must be the first middleware.
+
+    Enabled with DEBUG by default, production can instrument a sample of the requests
+    with SQL_INSTRUMENTATION and SQL_INSTRUMENTATION_SAMPLE_RATE.
+    """
+    def process_request(self, request):
+        if SQL_INSTRUMENTATION and random.random() < SQL_INSTRUMENTATION_SAMPLE_RATE:
+            request.sql_use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            request.sql_queries_start = len(connection.queries)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.sql_resource_name = view_kwargs.get('resource_name')
 
     def process_response(self, request, response):
-        if request.method == 'GET':
-            try:
-                view, args, kwargs = resolve(request.path)
-                resource_name = kwargs.get("resource_name", None)
-            except:
-                resource_name = None
-
-            if resource_name :
-                if resource_name in settings.PAGEVIEWS_FILTER:
-                    pageviews_counter = 0
-                    try:
-                        content = json.loads(response.content)
-                    except:
-                        return response
-                    if 'objects' in content and len(content['objects']) == 1:
-                        resource_uri = content['objects'][0]['resource_uri']
-                        created = False
-                        autorepare = True #sometimes doublons can be created, don't know why
-                        while autorepare:
-                            autorepare = False
-                            if request.user.is_authenticated() :
-                                try:
-                                    pv, created = PageViews.objects.get_or_create(client=request.user.username, resource_uri=resource_uri)
-                                except PageViews.MultipleObjectsReturned:
-                                    pv = PageViews.objects.filter(client=request.user.username, resource_uri=resource_uri)
-                                    PageViews.objects.exclude(id=pv[0].id).delete()
-                                    autorepare = True
-                            else:
-                                try:
-                                    pv, created = PageViews.objects.get_or_create(client=get_ip(request), resource_uri=resource_uri)
-                                except PageViews.MultipleObjectsReturned:
-                                    pv = PageViews.objects.filter(client=get_ip(request), resource_uri=resource_uri)
-                                    PageViews.objects.exclude(id=pv[0].id).delete()
-                                    autorepare = True
-
-                        pageviews_counter = PageViews.objects.filter(resource_uri=resource_uri).count()
-                        content['objects'][0]['pageviews_counter'] = pageviews_counter
-                        return HttpResponse(json.dumps(content), content_type="application/json")
+        if not hasattr(request, 'sql_queries_start'):
+            return response
+        stats = QueryStats(connection.queries[request.sql_queries_start:])
+        connection.use_debug_cursor = request.sql_use_debug_cursor
+
+        if SQL_INSTRUMENTATION_HEADERS:
+            response['X-SQL-Queries'] = stats.count
+            response['X-SQL-Time'] = '%.1fms' % (stats.time * 1000)
+            response['X-SQL-Duplicates'] = stats.duplicates_count()
+
+        resource_name = getattr(request, 'sql_resource_name', None)
+        budget = query_budget(resource_name) if resource_name else None
+        if budget is not None and stats.count > budget:
+            sql_logger.warning("%s %s ran %s queries (budget %s) in %.1fms, most duplicated : %s",
+                               request.method, request.path, stats.count, budget, stats.time * 1000,
+                               stats.duplicates()[:3])
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Observe the latency of the API requests and count their server errors, per resource name and method
+    """
+    def process_request(self, request):
+        request.metrics_start = time.time()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_resource_name = view_kwargs.get('resource_name')
+
+    def process_response(self, request, response):
+        resource_name = getattr(request, 'metrics_resource_name', None)
+        if resource_name and hasattr(request, 'metrics_start'):
+            request_duration.observe(time.time() - request.metrics_start, resource=resource_name, method=request.method)
+            if response.status_code >= 500:
+                request_errors.inc(resource=resource_name, method=request.method, status=response.status_code)
+        return response
+
+
+PROFILER_HIDDEN_PARAMETERS = ('username', 'api_key', 'password')
+
+def profiled_path(request):
+    # The tastypie credentials must not end up in the admin
+    params = request.GET.copy()
+    for name in PROFILER_HIDDEN_PARAMETERS:
+        params.pop(name, None)
+    return request.path + ('?%s' % params.urlencode() if params else '')
+
+class ProfilerMiddleware(object):
+    """
+    Profile the view of the requests of staff members sending an X-Profile header or a profile=1 parameter.
+    The profile is saved in PROFILER_DIR and listed in the admin, its id is returned in the X-Profile-Id header.
+
+    The view is called from process_view: it runs in the ATOMIC_REQUESTS transaction like any view,
+    but the process_exception of the middlewares is skipped when it raises.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not (request.user.is_staff and (request.META.get('HTTP_X_PROFILE') or request.GET.get('profile') == '1')):
+            return None
 
+        request_id = uuid.uuid4().hex
+        profiler = cProfile.Profile()
+        start = time.time()
+        try:
+            response = profiler.runcall(BaseHandler().make_view_atomic(view_func), request, *view_args, **view_kwargs)
+        finally:
+            # Saved even when the view raises
+            duration = time.time() - start
+            pstats_file, collapsed_file, top_functions = save_profile(profiler, PROFILER_DIR, request_id)
+            ProfiledRequest.objects.create(request_id=request_id,
+                                           method=request.method,
+                                           path=profiled_path(request),
+                                           user=request.user,
+                                           duration=duration,
+                                           top_functions=top_functions,
+                                           pstats_file=pstats_file,
+                                           collapsed_file=collapsed_file)
+        response['X-Profile-Id'] = request_id
         return response
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'PageViewsCounter'
+        db.create_table(u'makerscience_admin_pageviewscounter', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('resource_uri', self.gf('django.db.models.fields.CharField')(unique=True, max_length=255)),
+            ('total', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('unique_visitors', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('sketch', self.gf('django.db.models.fields.TextField')(blank=True)),
+        ))
+        db.send_create_signal(u'makerscience_admin', ['PageViewsCounter'])
+
+        # Adding model 'PageViewsDay'
+        db.create_table(u'makerscience_admin_pageviewsday', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('resource_uri', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('day', self.gf('django.db.models.fields.DateField')()),
+            ('views', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'makerscience_admin', ['PageViewsDay'])
+
+        # Adding unique constraint on 'PageViewsDay', fields ['resource_uri', 'day']
+        db.create_unique(u'makerscience_admin_pageviewsday', ['resource_uri', 'day'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'PageViewsDay', fields ['resource_uri', 'day']
+        db.delete_unique(u'makerscience_admin_pageviewsday', ['resource_uri', 'day'])
+
+        # Deleting model 'PageViewsCounter'
+        db.delete_table(u'makerscience_admin_pageviewscounter')
+
+        # Deleting model 'PageViewsDay'
+        db.delete_table(u'makerscience_admin_pageviewsday')
+
+
+    models = {
+        u'makerscience_admin.makersciencestaticcontent': {
+            'Meta': {'object_name': 'MakerScienceStaticContent'},
+            'about': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_cgu': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_contact': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_faq': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_howitworks': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_team': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'facebook': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'linkedin': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'mentions': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'project_thematic_selection': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'project_selection'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['taggit.Tag']"}),
+            'resource_thematic_selection': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'resource_selection'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['taggit.Tag']"}),
+            'twitter': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'youtube': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'})
+        },
+        u'makerscience_admin.pageviews': {
+            'Meta': {'object_name': 'PageViews'},
+            'client': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'resource_uri': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'makerscience_admin.pageviewscounter': {
+            'Meta': {'object_name': 'PageViewsCounter'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'resource_uri': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'sketch': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'total': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'unique_visitors': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'makerscience_admin.pageviewsday': {
+            'Meta': {'unique_together': "(('resource_uri', 'day'),)", 'object_name': 'PageViewsDay'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'resource_uri': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'views': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'taggit.tag': {
+            'Meta': {'object_name': 'Tag'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '100'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['makerscience_admin']
\ No newline at end of file
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'ProfiledRequest'
+        db.create_table(u'makerscience_admin_profiledrequest', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('request_id', self.gf('django.db.models.fields.CharField')(unique=True, max_length=32)),
+            ('method', self.gf('django.db.models.fields.CharField')(max_length=10)),
+            ('path', self.gf('django.db.models.fields.TextField')()),
+            ('user', self.gf('django.db.models.fields.related.ForeignKey')(blank=True, related_name='+', null=True, on_delete=models.SET_NULL, to=orm['auth.User'])),
+            ('duration', self.gf('django.db.models.fields.FloatField')()),
+            ('top_functions', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('pstats_file', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('collapsed_file', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('created_on', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+        ))
+        db.send_create_signal(u'makerscience_admin', ['ProfiledRequest'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'ProfiledRequest'
+        db.delete_table(u'makerscience_admin_profiledrequest')
+
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'makerscience_admin.makersciencestaticcontent': {
+            'Meta': {'object_name': 'MakerScienceStaticContent'},
+            'about': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_cgu': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_contact': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_faq': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_howitworks': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'about_team': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'facebook': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'linkedin': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'mentions': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'project_thematic_selection': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'project_selection'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['taggit.Tag']"}),
+            'resource_thematic_selection': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'resource_selection'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['taggit.Tag']"}),
+            'twitter': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'youtube': ('django.db.models.fields.URLField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'})
+        },
+        u'makerscience_admin.pageviews': {
+            'Meta': {'object_name': 'PageViews'},
+            'client': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'resource_uri': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'makerscience_admin.pageviewscounter': {
+            'Meta': {'object_name': 'PageViewsCounter'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'resource_uri': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'sketch': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'total': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'unique_visitors': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'makerscience_admin.pageviewsday': {
+            'Meta': {'unique_together': "(('resource_uri', 'day'),)", 'object_name': 'PageViewsDay'},
+            'day': ('django.db.models.fields.DateField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'resource_uri': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'views': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'makerscience_admin.profiledrequest': {
+            'Meta': {'ordering': "['-created_on']", 'object_name': 'ProfiledRequest'},
+            'collapsed_file': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'created_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'duration': ('django.db.models.fields.FloatField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'method': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'path': ('django.db.models.fields.TextField', [], {}),
+            'pstats_file': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'request_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '32'}),
+            'top_functions': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'+'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': u"orm['auth.User']"})
+        },
+        u'taggit.tag': {
+            'Meta': {'object_name': 'Tag'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '100'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['makerscience_admin']
\ No newline at end of file
@@ -1,15 +1,37 @@
 # -*- coding: utf-8 -*-
-from django.db import models
-from django.db.models.signals import post_delete
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, m2m_changed
 
 from solo.models import SingletonModel
 
 from accounts.models import ObjectProfileLink
+from megafon.models import Post
 from taggit.models import Tag
 
 from makerscience_forum.models import MakerSciencePost
 from makerscience_profile.models import MakerScienceProfile
-from makerscience_catalog.models import  MakerScienceProjectTaggedItem, MakerScienceResourceTaggedItem
+from makerscience_catalog.models import  MakerScienceProject, MakerScienceResource, MakerScienceProjectTaggedItem, MakerScienceResourceTaggedItem
+
+from .caching import check_shared_cache
+from .hyperloglog import HyperLogLog
+from .metrics import count_cache_lookups
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import hashlib
+import re
+import uuid
+
+# Checked once at startup, by the web processes and the commands alike
+check_shared_cache()
+
+PAGEVIEWS_CACHE_TIMEOUT = getattr(settings, 'PAGEVIEWS_CACHE_TIMEOUT', 60 * 60 * 24)
 
 class MakerScienceStaticContent (SingletonModel):
     about = models.TextField(null=True, blank=True)
@@ -21,10 +43,10 @@ class MakerScienceStaticContent (SingletonModel):
     mentions = models.TextField(null=True, blank=True)
 
     project_thematic_selection = models.ManyToManyField(Tag, related_name='project_selection',
-                                    limit_choices_to={'id__in' : MakerScienceProjectTaggedItem.objects.all().distinct('tag').values_list('tag', flat=True)},
+                                    limit_choices_to={'id__in' : MakerScienceProjectTaggedItem.objects.values('tag')},
                                     null=True, blank=True)
     resource_thematic_selection = models.ManyToManyField(Tag, related_name='resource_selection',
-                                    limit_choices_to={'id__in' : MakerScienceResourceTaggedItem.objects.all().distinct('tag').values_list('tag', flat=True)},
+                                    limit_choices_to={'id__in' : MakerScienceResourceTaggedItem.objects.values('tag')},
                                     null=True, blank=True)
 
     facebook = models.URLField(null=True, blank=True)
@@ -33,11 +55,194 @@ class MakerScienceStaticContent (SingletonModel):
     youtube = models.URLField(null=True, blank=True)
 
 
+STATIC_CONTENT_CACHE_TIMEOUT = getattr(settings, 'STATIC_CONTENT_CACHE_TIMEOUT', 60 * 60) # also refreshes the tag counts
+STATIC_CONTENT_VERSION_KEY = 'ms_static_content_version'
+
+def static_content_cache_key():
+    version = cache.get(STATIC_CONTENT_VERSION_KEY)
+    if version is None:
+        version = bump_static_content_version()
+    return 'ms_static_content_%s' % version
+
+def bump_static_content_version(**kwargs):
+    # A random version never reuses the key of a payload cached before an eviction
+    version = uuid.uuid4().hex
+    cache.set(STATIC_CONTENT_VERSION_KEY, version, None)
+    return version
+
+post_save.connect(bump_static_content_version, sender=MakerScienceStaticContent)
+m2m_changed.connect(bump_static_content_version, sender=MakerScienceStaticContent.project_thematic_selection.through)
+m2m_changed.connect(bump_static_content_version, sender=MakerScienceStaticContent.resource_thematic_selection.through)
+
+
 class PageViews(models.Model):
     client = models.CharField(max_length=255)
     resource_uri = models.CharField(max_length=255)
 
 
+class PageViewsCounter(models.Model):
+    """
+    Views of a resource, total and unique visitors estimated with a HyperLogLog sketch of the clients
+    """
+    resource_uri = models.CharField(max_length=255, unique=True)
+    total = models.PositiveIntegerField(default=0)
+    unique_visitors = models.PositiveIntegerField(default=0)
+    sketch = models.TextField(blank=True)
+
+    def add_clients(self, clients):
+        sketch = HyperLogLog.from_string(self.sketch)
+        for client in clients:
+            sketch.add(client)
+        self.sketch = sketch.to_string()
+        self.unique_visitors = sketch.count()
+        self.total += len(clients)
+
+
+class PageViewsDay(models.Model):
+    resource_uri = models.CharField(max_length=255)
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('resource_uri', 'day'),)
+
+
+def pageviews_cache_key(resource_uri):
+    return 'ms_pageviews_%s' % hashlib.md5(resource_uri.encode('utf-8')).hexdigest()
+
+def get_pageviews_count(resource_uri):
+    """
+    Return the estimated number of clients who viewed resource_uri
+    """
+    count = cache.get(pageviews_cache_key(resource_uri))
+    count_cache_lookups('pageviews', int(count is not None), int(count is None))
+    if count is None:
+        count = PageViewsCounter.objects.filter(resource_uri=resource_uri).values_list('unique_visitors', flat=True).first() or 0
+        cache.set(pageviews_cache_key(resource_uri), count, PAGEVIEWS_CACHE_TIMEOUT)
+    return count
+
+def create_missing(model, **kwargs):
+    # The unique constraints settle concurrent flushes creating the same row
+    try:
+        with transaction.atomic():
+            model.objects.create(**kwargs)
+    except IntegrityError:
+        pass
+
+def record_pageviews(views):
+    """
+    Add a list of (client, resource_uri) views to the counters of each resource and of the day
+    """
+    clients_by_uri = defaultdict(list)
+    for client, resource_uri in views:
+        clients_by_uri[resource_uri].append(client)
+    today = date.today()
+
+    existing_uris = set(PageViewsCounter.objects.filter(resource_uri__in=clients_by_uri.keys()).values_list('resource_uri', flat=True))
+    for resource_uri in set(clients_by_uri) - existing_uris:
+        create_missing(PageViewsCounter, resource_uri=resource_uri)
+
+    with transaction.atomic():
+        for counter in PageViewsCounter.objects.select_for_update().filter(resource_uri__in=clients_by_uri.keys()):
+            counter.add_clients(clients_by_uri[counter.resource_uri])
+            counter.save()
+            cache.set(pageviews_cache_key(counter.resource_uri), counter.unique_visitors, PAGEVIEWS_CACHE_TIMEOUT)
+
+    for resource_uri, clients in clients_by_uri.items():
+        if not PageViewsDay.objects.filter(resource_uri=resource_uri, day=today).update(views=F('views') + len(clients)):
+            create_missing(PageViewsDay, resource_uri=resource_uri, day=today)
+            PageViewsDay.objects.filter(resource_uri=resource_uri, day=today).update(views=F('views') + len(clients))
+
+POPULARITY_HALF_LIFE = getattr(settings, 'POPULARITY_HALF_LIFE', 7) # days
+POPULARITY_WINDOW = getattr(settings, 'POPULARITY_WINDOW', 90) # days, older events are ignored
+POPULARITY_LEVEL_WEIGHTS = getattr(settings, 'POPULARITY_LEVEL_WEIGHTS', {
+    2 : 2.0, 12 : 2.0, 33 : 2.0, # liked
+    3 : 3.0, 13 : 3.0, # commented
+    4 : 2.0, 14 : 2.0, # scored
+})
+POPULARITY_DEFAULT_WEIGHT = 1.0
+POPULARITY_VIEW_WEIGHT = getattr(settings, 'POPULARITY_VIEW_WEIGHT', 0.1)
+POPULARITY_MODELS = {
+    'project' : MakerScienceProject,
+    'resource' : MakerScienceResource,
+    'post' : MakerSciencePost,
+}
+PAGEVIEWS_URI_REGEX = re.compile(r'makerscience/(project|resource|post)(?:light)?/(\d+)/?$')
+
+def discussion_ids_by_post(post_ids):
+    """
+    Map megafon post ids, answers included, to the id of the MakerSciencePost of their discussion
+    """
+    tree_ids = dict(Post.objects.filter(id__in=post_ids).values_list('id', 'tree_id'))
+    discussions = dict(MakerSciencePost.objects.filter(parent__tree_id__in=set(tree_ids.values()), parent__level=0)
+                                               .values_list('parent__tree_id', 'id'))
+    return dict((post_id, discussions[tree_id]) for post_id, tree_id in tree_ids.items() if tree_id in discussions)
+
+def decay(age_days):
+    return 0.5 ** (age_days / float(POPULARITY_HALF_LIFE))
+
+def compute_popularity():
+    """
+    Score the projects, resources and posts from their recent activities and page views,
+    each event weighting less as it gets older. Return the number of updated objects.
+    """
+    today = date.today()
+    since = datetime.now() - timedelta(days=POPULARITY_WINDOW)
+    scores = dict((model, defaultdict(float)) for model in POPULARITY_MODELS.values())
+
+    for model, model_scores in scores.items():
+        # Forum links point at the megafon posts, the discussion or one of its answers
+        linked_model = Post if model is MakerSciencePost else model
+        links = ObjectProfileLink.objects.filter(content_type=ContentType.objects.get_for_model(linked_model),
+                                                 created_on__gte=since)
+        link_scores = defaultdict(float)
+        for object_id, level, created_on in links.values_list('object_id', 'level', 'created_on').iterator():
+            age = (datetime.now() - created_on).total_seconds() / 86400
+            link_scores[object_id] += POPULARITY_LEVEL_WEIGHTS.get(level, POPULARITY_DEFAULT_WEIGHT) * decay(age)
+
+        if linked_model is Post:
+            discussion_ids = discussion_ids_by_post(link_scores.keys())
+            for post_id, score in link_scores.items():
+                if post_id in discussion_ids:
+                    model_scores[discussion_ids[post_id]] += score
+        else:
+            model_scores.update(link_scores)
+
+    for resource_uri, day, views in PageViewsDay.objects.filter(day__gte=since.date()).values_list('resource_uri', 'day', 'views').iterator():
+        match = PAGEVIEWS_URI_REGEX.search(resource_uri)
+        if match:
+            scores[POPULARITY_MODELS[match.group(1)]][int(match.group(2))] += POPULARITY_VIEW_WEIGHT * views * decay((today - day).days)
+
+    # Only the changed scores are written, stale ones fall back to 0
+    updated = 0
+    for model, model_scores in scores.items():
+        with transaction.atomic():
+            for object_id, popularity in model.objects.values_list('id', 'popularity').iterator():
+                score = round(model_scores.get(object_id, 0.0), 3)
+                if score != popularity:
+                    model.objects.filter(id=object_id).update(popularity=score)
+                    updated += 1
+    return updated
+
+
+class ProfiledRequest(models.Model):
+    """
+    Request profiled by ProfilerMiddleware, the profile files are in PROFILER_DIR
+    """
+    request_id = models.CharField(max_length=32, unique=True)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    duration = models.FloatField() # seconds
+    top_functions = models.TextField(blank=True)
+    pstats_file = models.CharField(max_length=255)
+    collapsed_file = models.CharField(max_length=255)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_on']
+
+
 def clear_makerscience(sender, instance, **kwargs):
     if sender == MakerSciencePost:
         ObjectProfileLink.objects.filter(content_type__model='post',
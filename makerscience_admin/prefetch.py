@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from django.db.models.query import prefetch_related_objects
+
+from collections import defaultdict
+
+
+def prefetch_related_per_model(objects, lookups_by_model):
+    """
+    Prefetch the lookups of each model on a list of objects of different models,
+    such as the targets of generic relations. Return the objects keyed by model.
+    """
+    objects_by_model = defaultdict(list)
+    for obj in objects:
+        if obj is not None:
+            objects_by_model[type(obj)].append(obj)
+    for model, instances in objects_by_model.items():
+        if model in lookups_by_model:
+            prefetch_related_objects(instances, lookups_by_model[model])
+    return objects_by_model
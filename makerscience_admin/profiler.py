@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Output of the profiled requests: pstats dump, collapsed stacks for
+flamegraph.pl or speedscope, and a summary of the top functions.
+
+cProfile only records caller/callee pairs, the stacks are rebuilt from
+the roots by splitting the time of each function between its callers.
+"""
+from StringIO import StringIO
+
+import os
+import pstats
+
+COLLAPSED_MAX_DEPTH = 100
+
+
+def function_label(func):
+    filename, line, name = func
+    return '%s:%s:%s' % (os.path.basename(filename), line, name)
+
+def collapsed_stacks(stats):
+    """
+    Return the "frame;frame;frame microseconds" lines of the call stacks
+    """
+    children = {}
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    lines = []
+
+    def walk(func, stack, fraction):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        stack = stack + [function_label(func)]
+        own_time = int(tt * fraction * 1000000)
+        if own_time:
+            lines.append('%s %s' % (';'.join(stack), own_time))
+        if len(stack) >= COLLAPSED_MAX_DEPTH:
+            return
+        for child, edge_time in children.get(func, []):
+            child_time = stats.stats[child][3]
+            if child_time and function_label(child) not in stack:
+                walk(child, stack, fraction * edge_time / child_time)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return lines
+
+def save_profile(profiler, directory, request_id, top=30):
+    """
+    Write the pstats and collapsed stacks files of a profile in directory,
+    return their paths and the top functions by cumulative time
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    pstats_path = os.path.join(directory, '%s.pstats' % request_id)
+    collapsed_path = os.path.join(directory, '%s.collapsed' % request_id)
+
+    profiler.dump_stats(pstats_path)
+    summary = StringIO()
+    stats = pstats.Stats(pstats_path, stream=summary)
+    with open(collapsed_path, 'w') as collapsed:
+        collapsed.write('\n'.join(collapsed_stacks(stats)) + '\n')
+
+    stats.sort_stats('cumulative').print_stats(top)
+    return pstats_path, collapsed_path, summary.getvalue()
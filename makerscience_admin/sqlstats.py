@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics on the SQL queries run by a block of code, used by
+SQLInstrumentationMiddleware and by tests asserting query budgets:
+
+    with capture_queries() as stats:
+        client.get('/api/v0/makerscience/project/?parent__slug=foo')
+    assert stats.count <= query_budget('makerscience/project')
+"""
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+
+from collections import Counter
+from contextlib import contextmanager
+
+import re
+
+SQL_QUERY_BUDGETS = getattr(settings, 'SQL_QUERY_BUDGETS', {}) # max queries per tastypie resource name
+SQL_QUERY_BUDGET_DEFAULT = getattr(settings, 'SQL_QUERY_BUDGET_DEFAULT', None)
+
+LITERALS_REGEX = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LISTS_REGEX = re.compile(r"IN \((?:\?, )*\?\)")
+
+def fingerprint(sql):
+    """
+    Return the query with its literal values replaced, identical for the queries differing only by their parameters
+    """
+    return IN_LISTS_REGEX.sub("IN (...)", LITERALS_REGEX.sub("?", sql))
+
+def query_budget(resource_name):
+    return SQL_QUERY_BUDGETS.get(resource_name, SQL_QUERY_BUDGET_DEFAULT)
+
+
+class QueryStats(object):
+
+    def __init__(self, queries=()):
+        self.queries = list(queries)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        """
+        Total SQL time in seconds
+        """
+        return sum(float(query['time']) for query in self.queries)
+
+    def duplicates(self):
+        """
+        Return the (fingerprint, count) of the queries run more than once, most repeated first
+        """
+        counts = Counter(fingerprint(query['sql']) for query in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count > 1]
+
+    def duplicates_count(self):
+        return sum(count - 1 for sql, count in self.duplicates())
+
+
+@contextmanager
+def capture_queries():
+    """
+    Record the queries run on the default connection within the block,
+    requests made with the test client included
+    """
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    # Starting a request would clear the queries recorded so far
+    request_started.disconnect(reset_queries)
+    start = len(connection.queries)
+    stats = QueryStats()
+    try:
+        yield stats
+    finally:
+        stats.queries = connection.queries[start:]
+        request_started.connect(reset_queries)
+        connection.use_debug_cursor = use_debug_cursor
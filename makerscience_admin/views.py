@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseForbidden
+
+from ipware.ip import get_ip
+
+from makerscience_notification.models import OutgoingEmail, NotificationEvent, NOTIFICATION_EVENT_MAX_ATTEMPTS
+from makerscience_profile.models import MakerScienceAvatarJob
+
+from .metrics import registry, Gauge
+
+METRICS_ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1',))
+
+
+def count_by_status(model):
+    return [({'status' : status}, count) for status, count in model.objects.order_by().values_list('status').annotate(Count('id'))]
+
+def count_notification_events():
+    return [
+        ({'status' : 'PENDING'}, NotificationEvent.objects.filter(processed_on__isnull=True, attempts__lt=NOTIFICATION_EVENT_MAX_ATTEMPTS).count()),
+        ({'status' : 'FAILED'}, NotificationEvent.objects.filter(processed_on__isnull=True, attempts__gte=NOTIFICATION_EVENT_MAX_ATTEMPTS).count()),
+    ]
+
+# Background jobs run in their own processes, their queues are read from the database
+registry.register(Gauge('makerscience_outbox_emails', 'Emails of the outbox by status', lambda: count_by_status(OutgoingEmail)))
+registry.register(Gauge('makerscience_avatar_jobs', 'Avatar processing jobs by status', lambda: count_by_status(MakerScienceAvatarJob)))
+registry.register(Gauge('makerscience_notification_events', 'Activities waiting for their notifications, or failed', count_notification_events))
+
+
+def metrics(request):
+    """
+    Metrics in the Prometheus text format
+    """
+    if get_ip(request) not in METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -22,7 +22,7 @@ from tastypie.constants import ALL_WITH_RELATIONS
 from tastypie.resources import ModelResource
 from tastypie.utils import trailing_slash
 
-from makerscience_admin.api import SearchableMakerScienceResource
+from makerscience_admin.api import SearchableMakerScienceResource, PageViewsCounterResource
 from .models import MakerScienceProject, MakerScienceResource, MakerScienceProjectTaggedItem, MakerScienceResourceTaggedItem
 from makerscience_server.authorizations  import  MakerScienceAPIAuthorization
 from accounts.models import ObjectProfileLink, Profile
@@ -118,7 +118,7 @@ class MakerScienceProjectAuthorization(MakerScienceAPIAuthorization):
             delete_permission_code="makerscience_catalog.delete_makerscienceproject"
         )
 
-class MakerScienceProjectResourceLight(MakerScienceCatalogResource):
+class MakerScienceProjectResourceLight(PageViewsCounterResource, MakerScienceCatalogResource):
     parent_id = fields.IntegerField('parent__id')
     slug = fields.CharField('parent__slug')
     title = fields.CharField('parent__title')
@@ -137,11 +137,12 @@ class MakerScienceProjectResourceLight(MakerScienceCatalogResource):
             'parent_id' : ['exact'],
             'id' : ['exact'],
         }
+        ordering = ['popularity']
 
     def dehydrate(self, bundle):
         return self.dehydrate_author(bundle)
 
-class MakerScienceResourceResourceLight(MakerScienceCatalogResource):
+class MakerScienceResourceResourceLight(PageViewsCounterResource, MakerScienceCatalogResource):
     parent_id = fields.IntegerField('parent__id')
     slug = fields.CharField('parent__slug')
     title = fields.CharField('parent__title')
@@ -160,11 +161,12 @@ class MakerScienceResourceResourceLight(MakerScienceCatalogResource):
             'parent_id' : ['exact'],
             'id' : ['exact'],
         }
+        ordering = ['popularity']
 
     def dehydrate(self, bundle):
         return self.dehydrate_author(bundle)
 
-class MakerScienceProjectResource(MakerScienceCatalogResource):
+class MakerScienceProjectResource(PageViewsCounterResource, MakerScienceCatalogResource):
     tags = fields.ToManyField('makerscience_catalog.api.MakerScienceProjectTaggedItemResource', 'tagged_items', full=True, null=True, readonly=True)
 
     class Meta:
@@ -180,6 +182,7 @@ class MakerScienceProjectResource(MakerScienceCatalogResource):
             'parent' : ALL_WITH_RELATIONS,
             'featured' : ['exact'],
         }
+        ordering = ['popularity']
         limit = 6
 
 class MakerScienceResourceAuthorization(MakerScienceAPIAuthorization):
@@ -191,7 +194,7 @@ class MakerScienceResourceAuthorization(MakerScienceAPIAuthorization):
             delete_permission_code="makerscience_catalog.delete_makerscienceresource"
         )
 
-class MakerScienceResourceResource(MakerScienceCatalogResource):
+class MakerScienceResourceResource(PageViewsCounterResource, MakerScienceCatalogResource):
     tags = fields.ToManyField('makerscience_catalog.api.MakerScienceResourceTaggedItemResource', 'tagged_items', full=True, null=True, readonly=True)
 
     class Meta:
@@ -207,6 +210,7 @@ class MakerScienceResourceResource(MakerScienceCatalogResource):
             'parent' : ALL_WITH_RELATIONS,
             'featured' : ['exact'],
         }
+        ordering = ['popularity']
         limit = 6
 
 class MakerScienceProjectTaggedItemResource(TaggedItemResource):
@@ -58,6 +58,7 @@ class MakerScienceProject(models.Model):
     linked_resources = models.ManyToManyField("MakerScienceResource", null=True, blank=True)
 
     featured = models.BooleanField(default=False)
+    popularity = models.FloatField(default=0, db_index=True) # updated by the compute_popularity command
 
     def __unicode__(self):
         return self.parent.title
@@ -83,6 +84,7 @@ class MakerScienceResource(models.Model):
     linked_resources = models.ManyToManyField("MakerScienceResource", null=True, blank=True)
 
     featured = models.BooleanField(default=False)
+    popularity = models.FloatField(default=0, db_index=True) # updated by the compute_popularity command
 
     class Meta :
         ordering = ['parent__created_on',]
@@ -17,6 +17,7 @@ class MakerScienceProjectIndex(indexes.SearchIndex, indexes.Indexable):
     featured = indexes.BooleanField(model_attr='featured')
     created_on = indexes.DateTimeField(model_attr='parent__created_on')
     total_score = indexes.FloatField()
+    popularity = indexes.FloatField(model_attr='popularity')
 
     def get_model(self):
       return MakerScienceProject
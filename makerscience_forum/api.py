@@ -12,7 +12,7 @@ from haystack.query import SearchQuerySet
 from dataserver.authentication import AnonymousApiKeyAuthentication
 from megafon.api  import PostResource
 
-from makerscience_admin.api import SearchableMakerScienceResource
+from makerscience_admin.api import SearchableMakerScienceResource, PageViewsCounterResource
 from makerscience_catalog.api import MakerScienceProjectResourceLight, MakerScienceResourceResourceLight
 from makerscience_server.authorizations import MakerScienceAPIAuthorization
 from .models import MakerSciencePost
@@ -28,7 +28,7 @@ class MakerSciencePostAuthorization(MakerScienceAPIAuthorization):
             delete_permission_code="makerscience_forum.delete_makersciencepost"
         )
 
-class MakerSciencePostResourceLight(ModelResource, SearchableMakerScienceResource):
+class MakerSciencePostResourceLight(PageViewsCounterResource, ModelResource, SearchableMakerScienceResource):
     slug = fields.CharField('parent__slug')
     parent_id = fields.IntegerField('parent__id')
     updated_on = fields.DateField('parent__updated_on')
@@ -48,6 +48,7 @@ class MakerSciencePostResourceLight(ModelResource, SearchableMakerScienceResourc
             'parent_id' : ['exact'],
             'id' : ['exact'],
         }
+        ordering = ['popularity']
 
     def prepend_urls(self):
         return [
@@ -55,7 +56,7 @@ class MakerSciencePostResourceLight(ModelResource, SearchableMakerScienceResourc
         ]
 
 
-class MakerSciencePostResource(ModelResource, SearchableMakerScienceResource):
+class MakerSciencePostResource(PageViewsCounterResource, ModelResource, SearchableMakerScienceResource):
     parent = fields.ToOneField(PostResource, 'parent', full=True)
 
     linked_projects = fields.ToManyField(MakerScienceProjectResourceLight, 'linked_projects', full=True,null=True)
@@ -73,6 +74,7 @@ class MakerSciencePostResource(ModelResource, SearchableMakerScienceResource):
             'post_type' : ['exact'],
             'linked_projects' : ['isnull']
         }
+        ordering = ['popularity']
         limit = 7
 
     def prepend_urls(self):
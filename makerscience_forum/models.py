@@ -29,3 +29,5 @@ class MakerSciencePost(models.Model):
 
     linked_projects = models.ManyToManyField(MakerScienceProject, null=True, blank=True)
     linked_resources = models.ManyToManyField(MakerScienceResource, null=True, blank=True)
+
+    popularity = models.FloatField(default=0, db_index=True) # updated by the compute_popularity command
@@ -10,6 +10,7 @@ class MakerSciencePostIndex(indexes.SearchIndex, indexes.Indexable):
   posted_on = indexes.DateTimeField(model_attr='parent__posted_on')
   updated_on = indexes.DateTimeField(model_attr='parent__updated_on')
   answers_count = indexes.IntegerField(model_attr='parent__answers_count')
+  popularity = indexes.FloatField(model_attr='popularity')
 
   def get_model(self):
       return MakerSciencePost
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+from django.conf import settings
+from django.conf.urls import url
+from django.http import StreamingHttpResponse
+from django.contrib.contenttypes.models import ContentType
 from django.template.loader import render_to_string
 
 from tastypie.resources import ModelResource
 from tastypie.constants import ALL_WITH_RELATIONS
 from tastypie.utils import trailing_slash
+from tastypie.exceptions import BadRequest
+from tastypie.http import HttpUnauthorized
 from tastypie import fields
 from tastypie.authorization import DjangoAuthorization
 
@@ -13,14 +19,43 @@ from notifications.views import live_unread_notification_count, live_unread_noti
 from accounts.api import UserResource
 from dataserver.authentication import AnonymousApiKeyAuthentication
 
+from makerscience_admin.api import KeysetPaginator
 from makerscience_profile.models import MakerScienceProfile
 
+from .live import wait_for_notifications, waiting_slot, LIVE_TIMEOUT
+from .models import get_notification_descriptions, get_unread_count, mark_all_as_read
+
+import time
+
+LIVE_STREAM_DURATION = getattr(settings, 'LIVE_NOTIFICATION_STREAM_DURATION', 5 * 60) # seconds
+LIVE_BUSY_RETRY = getattr(settings, 'LIVE_NOTIFICATION_BUSY_RETRY', 30) # seconds before a client reconnects when no waiting slot is free
+
+def get_requester_profile_id(request):
+    """
+    Return the MakerScienceProfile id of the requester, looked up once per session
+    """
+    session = getattr(request, 'session', None)
+    if session is not None and session.get('makerscience_profile_user_id') == request.user.id:
+        return session['makerscience_profile_id']
+
+    profile_id = MakerScienceProfile.objects.filter(parent__user=request.user).values_list('id', flat=True).get()
+    if session is not None:
+        session['makerscience_profile_user_id'] = request.user.id
+        session['makerscience_profile_id'] = profile_id
+    return profile_id
+
+
+class NotificationPaginator(KeysetPaginator):
+    date_field = 'timestamp'
+
+
 class NotificationResource(ModelResource):
     actor_content_type = fields.CharField(attribute='actor_content_type__model', null=True)
     target_content_type = fields.CharField(attribute='target_content_type__model', null=True)
     action_object_content_type = fields.CharField(attribute='action_object_content_type__model', null=True)
 
     recipient_id = fields.CharField(attribute='recipient__id', null=True)
+    others_count = fields.IntegerField(default=0, readonly=True)
 
     class Meta:
         queryset = Notification.objects.all()
@@ -29,18 +64,137 @@ class NotificationResource(ModelResource):
         always_return_data = True
         authentication = AnonymousApiKeyAuthentication()
         authorization = DjangoAuthorization()
-        limit = 0
+        limit = 20
+        max_limit = 100
+        paginator_class = NotificationPaginator
         excludes = ['data', 'emailed', 'public']
         filtering = {
             'recipient_id' : ['exact']
         }
         ordering = ['-timestamp',]
 
-    def dehydrate_description(self, bundle):
-        return bundle.obj.data['description']
+    def get_object_list(self, request):
+        return super(NotificationResource, self).get_object_list(request).select_related('actor_content_type',
+                                                                                         'target_content_type',
+                                                                                         'action_object_content_type')
+
+    def prepend_urls(self):
+        return [
+            url(r"^(?P<resource_name>%s)/unread/count%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('get_unread_count'), name="api_notification_unread_count"),
+            url(r"^(?P<resource_name>%s)/read/all%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('mark_all_as_read'), name="api_notification_mark_all_as_read"),
+            url(r"^(?P<resource_name>%s)/live/poll%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('live_poll'), name="api_notification_live_poll"),
+            url(r"^(?P<resource_name>%s)/live/stream%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('live_stream'), name="api_notification_live_stream"),
+        ]
+
+    def get_live_since(self, request):
+        # EventSource sends the id of the last received event when reconnecting
+        since = request.GET.get('since', request.META.get('HTTP_LAST_EVENT_ID', 0))
+        try:
+            return int(since)
+        except ValueError:
+            raise BadRequest("Invalid since '%s' provided, a notification id is expected." % since)
+
+    def dehydrate_live_notifications(self, request, notifs):
+        bundles = [self.full_dehydrate(self.build_bundle(obj=notif, request=request), for_list=True) for notif in notifs]
+        self.fill_descriptions(bundles)
+        return bundles
+
+    def live_poll(self, request, **kwargs):
+        """
+        Long-poll: answer as soon as the requester has notifications newer than since
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        since = self.get_live_since(request)
+        if request.user.is_anonymous():
+            return self.create_response(request, {'objects' : [], 'since' : since})
+
+        with waiting_slot() as waiting:
+            notifs = wait_for_notifications(request.user.id, since, LIVE_TIMEOUT if waiting else 0)
+        return self.create_response(request, {
+            'objects' : self.dehydrate_live_notifications(request, notifs),
+            'since' : notifs[-1].id if notifs else since,
+            'unread_count' : get_unread_count(request.user.id),
+        })
+
+    def live_stream(self, request, **kwargs):
+        """
+        Server-sent events: one "notification" event per new notification, until LIVE_STREAM_DURATION
+        after which the EventSource reconnects with the id of the last event
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        if request.user.is_anonymous():
+            return HttpUnauthorized()
+
+        since = self.get_live_since(request)
+        user_id = request.user.id
+
+        def events(since):
+            with waiting_slot() as waiting:
+                # Without a waiting slot, send what is already there and close the stream
+                deadline = time.time() + (LIVE_STREAM_DURATION if waiting else 0)
+                while True:
+                    notifs = wait_for_notifications(user_id, since, max(min(LIVE_TIMEOUT, deadline - time.time()), 0))
+                    for bundle in self.dehydrate_live_notifications(request, notifs):
+                        yield "id: %s\nevent: notification\ndata: %s\n\n" % (bundle.obj.id, self.serialize(request, bundle, 'application/json'))
+                    if notifs:
+                        since = notifs[-1].id
+                    if time.time() >= deadline:
+                        break
+                    if not notifs:
+                        yield ": keepalive\n\n"
+            if not waiting:
+                yield "retry: %s\n\n" % (LIVE_BUSY_RETRY * 1000)
+
+        response = StreamingHttpResponse(events(since), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def get_unread_count(self, request, **kwargs):
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        if request.user.is_anonymous():
+            return self.create_response(request, {'unread_count' : 0})
+        return self.create_response(request, {'unread_count' : get_unread_count(request.user.id)})
+
+    def mark_all_as_read(self, request, **kwargs):
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        if request.user.is_anonymous():
+            return self.create_response(request, {'success' : False})
+        return self.create_response(request, {'success' : True, 'updated' : mark_all_as_read(request.user.id)})
+
+    def dehydrate_recipient_id(self, bundle):
+        return bundle.obj.recipient_id
+
+    def dehydrate_others_count(self, bundle):
+        return (bundle.obj.data or {}).get('others_count', 0)
+
+    def fill_descriptions(self, bundles):
+        descriptions = get_notification_descriptions([bundle.obj for bundle in bundles])
+        for bundle in bundles:
+            bundle.data['description'] = descriptions[bundle.obj.id]
+
+    def alter_list_data_to_serialize(self, request, data):
+        self.fill_descriptions(data[self._meta.collection_name])
+        return data
+
+    def alter_detail_data_to_serialize(self, request, data):
+        self.fill_descriptions([data])
+        return data
 
     def apply_filters(self, request, applicable_filters):
         if request.user.is_anonymous():
             return ModelResource.apply_filters(self, request, applicable_filters)
 
-        return self.get_object_list(request).filter(**applicable_filters).exclude(actor_object_id=MakerScienceProfile.objects.get(parent__user=request.user).id)
+        return self.get_object_list(request).filter(**applicable_filters).exclude(actor_content_type=ContentType.objects.get_for_model(MakerScienceProfile),
+                                                                                  actor_object_id=str(get_requester_profile_id(request)))
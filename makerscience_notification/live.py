@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Wakeup of the clients waiting for new notifications.
+
+Publishing stores in the cache the latest notification id known for each
+recipient, and wakes up the requests waiting in this process. Requests
+served by other processes notice the new stamp within LIVE_POLL_INTERVAL,
+with a cache read and no query. The database is only queried when a stamp
+moved past the client cursor.
+
+Notifications are mostly published by the process_notification_events
+worker, so the stamps only reach the web processes through a cache shared
+by all the processes (memcached, redis), see makerscience_admin.caching.
+With a process-local cache, only allowed by LOCAL_CACHE_ALLOWED, requests
+are answered without waiting.
+
+Waiting requests hold a worker thread, the server must run threaded workers.
+At most LIVE_MAX_WAITERS requests wait in each process, the requests above
+are answered right away and the clients poll again.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from notifications.models import Notification
+
+from makerscience_admin.caching import is_shared_cache
+
+from contextlib import contextmanager
+
+import logging
+import threading
+import time
+
+LIVE_POLL_INTERVAL = getattr(settings, 'LIVE_NOTIFICATION_POLL_INTERVAL', 1) # seconds
+LIVE_TIMEOUT = getattr(settings, 'LIVE_NOTIFICATION_TIMEOUT', 25) # seconds
+LIVE_MAX_WAITERS = getattr(settings, 'LIVE_NOTIFICATION_MAX_WAITERS', 8) # per process
+LIVE_STAMP_TIMEOUT = 60 * 60 * 24
+
+logger = logging.getLogger(__name__)
+
+LIVE_SHARED_CACHE = is_shared_cache()
+if not LIVE_SHARED_CACHE:
+    logger.warning("The default cache is local to each process, live notifications are answered without waiting.")
+
+_new_notifications = threading.Condition()
+_waiters = threading.Semaphore(LIVE_MAX_WAITERS)
+
+def live_stamp_key(user_id):
+    return 'ms_notif_live_%s' % user_id
+
+def publish_notifications(user_ids, latest_id=None):
+    """
+    Signal that the given users have notifications up to latest_id,
+    the latest notification id overall when not given
+    """
+    if latest_id is None:
+        latest_id = Notification.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    cache.set_many(dict((live_stamp_key(user_id), latest_id) for user_id in user_ids), LIVE_STAMP_TIMEOUT)
+    with _new_notifications:
+        _new_notifications.notify_all()
+
+@contextmanager
+def waiting_slot():
+    """
+    Reserve one of the LIVE_MAX_WAITERS waiting slots of the process,
+    yield False when they are all taken or when waiting would be useless
+    """
+    acquired = LIVE_SHARED_CACHE and _waiters.acquire(False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _waiters.release()
+
+def wait_for_notifications(user_id, since, timeout=LIVE_TIMEOUT):
+    """
+    Block until the user has notifications with an id greater than since,
+    or until timeout. Return them, oldest first, or an empty list.
+    Callers hold a waiting_slot, and check once with a zero timeout without one.
+    """
+    deadline = time.time() + timeout
+    checked_stamp = None
+    while True:
+        stamp = cache.get(live_stamp_key(user_id))
+        if stamp is None or (stamp > since and stamp != checked_stamp):
+            notifs = list(Notification.objects.filter(recipient=user_id, id__gt=since).order_by('id'))
+            if notifs:
+                return notifs
+            if stamp is None:
+                # Nothing newer than since, until the next publication
+                cache.add(live_stamp_key(user_id), since, LIVE_STAMP_TIMEOUT)
+            checked_stamp = stamp
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return []
+        with _new_notifications:
+            _new_notifications.wait(min(LIVE_POLL_INTERVAL, remaining))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from notifications.models import Notification
+
+from makerscience_notification.models import archive_notifications, prune_orphan_notifications, NOTIFICATION_RETENTION_DAYS
+
+from datetime import datetime, timedelta
+
+import time
+
+class Command(BaseCommand):
+    help = "Move the old read notifications to the archive table and delete the notifications whose objects no longer exist."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', '-d',
+                    dest='days',
+                    type='int',
+                    default=NOTIFICATION_RETENTION_DAYS,
+                    help='Age in days from which read notifications are archived'),
+        make_option('--batch-size', '-b',
+                    dest='batch_size',
+                    type='int',
+                    default=1000,
+                    help='Number of notifications processed at once'),
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help='Only count the notifications to archive and prune'),
+    )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        if options['dry_run']:
+            archived = Notification.objects.filter(unread=False, timestamp__lt=datetime.now() - timedelta(days=options['days'])).count()
+            print "%s notification(s) to archive" % archived
+        else:
+            archived = archive_notifications(options['days'], options['batch_size'])
+            self.report("archived", archived, start)
+
+        start = time.time()
+        pruned = prune_orphan_notifications(options['batch_size'], options['dry_run'])
+        if options['dry_run']:
+            print "%s orphan notification(s) to prune" % pruned
+        else:
+            self.report("pruned", pruned, start)
+
+    def report(self, action, count, start):
+        duration = time.time() - start
+        print "%s notification(s) %s in %.1fs (%.0f/s)" % (count, action, duration, count / duration if duration else 0)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from makerscience_notification.models import process_notification_events
+
+class Command(BaseCommand):
+    help = "Dispatch the notifications of the activities recorded since the last run."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', '-b',
+                    dest='batch_size',
+                    type='int',
+                    default=100,
+                    help='Number of events read at once'),
+    )
+
+    def handle(self, *args, **options):
+        processed, failed = process_notification_events(options['batch_size'])
+        print "%s event(s) processed, %s failed" % (processed, failed)
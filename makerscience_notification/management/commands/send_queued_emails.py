@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from makerscience_notification.models import send_queued_emails
+
+class Command(BaseCommand):
+    help = "Send the emails waiting in the outbox. To try it locally, run a debugging SMTP server " \
+           "(python -m smtpd -n -c DebuggingServer localhost:1025) with EMAIL_HOST='localhost' and EMAIL_PORT=1025."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', '-b',
+                    dest='batch_size',
+                    type='int',
+                    default=100,
+                    help='Number of emails read from the outbox at once'),
+    )
+
+    def handle(self, *args, **options):
+        sent, failed = send_queued_emails(options['batch_size'])
+        print "%s email(s) sent, %s failed" % (sent, failed)
@@ -1,9 +1,10 @@
 from django.core.management.base import BaseCommand
 
-from makerscience_notification.models import send_notifications_by_mail
+from makerscience_notification.models import send_notifications_by_mail, send_queued_emails
 
 class Command(BaseCommand):
     help = "My shiny new management command."
 
     def handle(self, *args, **options):
-        send_notifications_by_mail('WEEKLY')
+        print "%s digests queued" % send_notifications_by_mail('WEEKLY')
+        send_queued_emails()
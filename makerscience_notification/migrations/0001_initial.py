@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'OutgoingEmail'
+        db.create_table(u'makerscience_notification_outgoingemail', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('subject', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('from_email', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('to', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('text_content', self.gf('django.db.models.fields.TextField')()),
+            ('html_content', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('status', self.gf('django.db.models.fields.CharField')(default='PENDING', max_length=7)),
+            ('attempts', self.gf('django.db.models.fields.PositiveSmallIntegerField')(default=0)),
+            ('next_attempt_on', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('last_error', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created_on', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('sent_on', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+        ))
+        db.send_create_signal(u'makerscience_notification', ['OutgoingEmail'])
+
+        # Adding index on 'OutgoingEmail', fields ['status', 'next_attempt_on']
+        db.create_index(u'makerscience_notification_outgoingemail', ['status', 'next_attempt_on'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'OutgoingEmail', fields ['status', 'next_attempt_on']
+        db.delete_index(u'makerscience_notification_outgoingemail', ['status', 'next_attempt_on'])
+
+        # Deleting model 'OutgoingEmail'
+        db.delete_table(u'makerscience_notification_outgoingemail')
+
+
+    models = {
+        u'makerscience_notification.outgoingemail': {
+            'Meta': {'object_name': 'OutgoingEmail', 'index_together': "(('status', 'next_attempt_on'),)"},
+            'attempts': ('django.db.models.fields.PositiveSmallIntegerField', [], {'default': '0'}),
+            'created_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_email': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'html_content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'next_attempt_on': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'sent_on': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'PENDING'", 'max_length': '7'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'text_content': ('django.db.models.fields.TextField', [], {}),
+            'to': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['makerscience_notification']
@@ -1,220 +1,763 @@
 # -*- coding: utf-8 -*-
-from django.db import models
-from django.db.models.signals import pre_save, post_save
+from django.contrib.auth.models import User
+from django.db import models, connection, transaction
+from django.core.cache import cache
+from django.db.models.query import prefetch_related_objects
+from django.db.models.signals import post_save, post_delete
 from django.template.loader import render_to_string
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils.timezone import now
 
-from notifications import notify
 from notifications.models import Notification
 
 from accounts.models import ObjectProfileLink
 
-from makerscience_profile.models import MakerScienceProfile
+from makerscience_profile.models import MakerScienceProfile, get_profile_by_slug
 from makerscience_catalog.models import MakerScienceProject, MakerScienceResource
 from makerscience_forum.models import MakerSciencePost
+from makerscience_admin.metrics import count_cache_lookups
+from makerscience_admin.prefetch import prefetch_related_per_model
 
+from .live import publish_notifications
+
+from collections import defaultdict
+from contextlib import contextmanager
+from multiprocessing import Pool
 from datetime import datetime, timedelta
 
-def create_notification(sender, instance, created, **kwargs):
-    activity = instance
-    if sender == ObjectProfileLink and created:
-        actor = MakerScienceProfile.objects.get(parent=activity.profile)
-
-        is_not_actor = lambda x: x is not actor.parent.id
-
-        if activity.level == 50:
-            tag = activity.content_object.tag
-            profile_ids = ObjectProfileLink.objects.filter(level=51,
-                                                   content_type=ContentType.objects.get_for_model(tag),
-                                                   object_id=tag.id).values_list('profile', flat=True)
-
-            for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                notify.send(actor,
-                            recipient=profile.parent.user,
-                            verb=u'tagged',
-                            action_object=tag,
-                            target=activity.content_object.content_object)
-        elif activity.level == 0:
-            if activity.isValidated == False: #someome ask to join project team
-                profile_ids = ObjectProfileLink.objects.filter(level=0,
-                                                               isValidated=True,
-                                                               content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                               object_id=activity.content_object.id).values_list('profile', flat=True)
-
-                for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                    notify.send(actor,
-                                recipient=profile.parent.user,
-                                target=activity.content_object,
-                                verb=u'team_requested')
-            else :#someone has created a project
-                profile_ids = ObjectProfileLink.objects.filter(level=40,
-                                                               content_type=ContentType.objects.get_for_model(actor),
-                                                               object_id=actor.id).values_list('profile', flat=True)
-
-                for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                    notify.send(actor,
-                                recipient=profile.parent.user,
-                                action_object=activity.content_object,
-                                verb=u'created')
-        elif activity.level == 1:
-                profile_ids = ObjectProfileLink.objects.filter(level=0,
-                                                               isValidated=True,
-                                                               content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                               object_id=activity.content_object.id).values_list('profile', flat=True)
-
-                for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                    notify.send(actor,
-                                recipient=profile.parent.user,
-                                target=activity.content_object,
-                                verb=u'help_proposed')
-        elif activity.level == 10:
-            if activity.isValidated == False: #someome ask to join project team
-                profile_ids = ObjectProfileLink.objects.filter(level=10,
-                                                               isValidated=True,
-                                                               content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                               object_id=activity.content_object.id).values_list('profile', flat=True)
-
-                for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                    notify.send(actor,
-                                recipient=profile.parent.user,
-                                target=activity.content_object,
-                                verb=u'coauthor_requested')
-            else :#someone has created a project
-                profile_ids = ObjectProfileLink.objects.filter(level=40,
-                                                               content_type=ContentType.objects.get_for_model(actor),
-                                                               object_id=actor.id).values_list('profile', flat=True)
-
-                for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                    notify.send(actor,
-                                recipient=profile.parent.user,
-                                action_object=activity.content_object,
-                                verb=u'created')
-        elif activity.level == 11:
-                profile_ids = ObjectProfileLink.objects.filter(level=10,
-                                                               isValidated=True,
-                                                               content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                               object_id=activity.content_object.id).values_list('profile', flat=True)
-
-                for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                    notify.send(actor,
-                                recipient=profile.parent.user,
-                                target=activity.content_object,
-                                verb=u'similars_shared')
-        elif activity.level == 5: #someone has been invited to join  a project team
-            notify.send(MakerScienceProfile.objects.get(slug=activity.detail),
-                        recipient=actor.parent.user,
-                        target=activity.content_object,
-                        verb=u'team_invited')
-        elif activity.level == 6: #someone has been invited to help  a project team
-            notify.send(MakerScienceProfile.objects.get(slug=activity.detail),
-                        recipient=actor.parent.user,
-                        target=activity.content_object,
-                        verb=u'help_invited')
-        elif activity.level == 7: #someone added a news to a project
-            profile_ids = ObjectProfileLink.objects.filter(level__in=[0, 1, 2],
-                                                           isValidated=True,
-                                                           content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                           object_id=activity.content_object.id).distinct('profile').values_list('profile', flat=True)
-
-            for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                notify.send(actor,
-                            recipient=profile.parent.user,
-                            target=activity.content_object,
-                            verb=u'annonced')
-        elif activity.level == 15: #someone has been invited to join  co-author
-            notify.send(MakerScienceProfile.objects.get(slug=activity.detail),
-                        recipient=actor.parent.user,
-                        target=activity.content_object,
-                        verb=u'coauthor_invited')
-        elif activity.level == 16: #someone has been invited to shared his similar resource
-            notify.send(MakerScienceProfile.objects.get(slug=activity.detail),
-                        recipient=actor.parent.user,
-                        target=activity.content_object,
-                        verb=u'similar_resource_invited')
-        elif activity.level in [2, 12, 33]: #liked content where the recipient is involved (creator, member)
-            target_levels = {
-                2 : [0, 1],
-                12 : [10, 11],
-                33 : [30, 31]
-            }
-            profile_ids = ObjectProfileLink.objects.filter(level__in=target_levels[activity.level],
-                                                           isValidated=True,
-                                                           content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                           object_id=activity.content_object.id).distinct('profile').values_list('profile', flat=True)
-
-            for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                notify.send(actor,
-                            recipient=profile.parent.user,
-                            action_object=activity.content_object,
-                            verb=u'liked')
-        elif activity.level in [3, 13]: #commented content where the recipient is involved (creator, member)
-            target_level = 0 if activity.level == 3 else 10
-            profile_ids = ObjectProfileLink.objects.filter(level=target_level,
-                                                           isValidated=True,
-                                                           content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                           object_id=activity.content_object.id).distinct('profile').values_list('profile', flat=True)
-
-            for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                notify.send(actor,
-                            recipient=profile.parent.user,
-                            action_object=activity.content_object,
-                            verb=u'commented')
-        elif activity.level in [4, 14]: #scored content where the recipient is involved (creator, member)
-            target_level = 0 if activity.level == 4 else 10
-            profile_ids = ObjectProfileLink.objects.filter(level=target_level,
-                                                           isValidated=True,
-                                                           content_type=ContentType.objects.get_for_model(activity.content_object),
-                                                           object_id=activity.content_object.id).distinct('profile').values_list('profile', flat=True)
-
-            for profile in MakerScienceProfile.objects.filter(parent__id__in=filter(is_not_actor, profile_ids)):
-                notify.send(actor,
-                            recipient=profile.parent.user,
-                            action_object=activity.content_object,
-                            verb=u'scored')
-        elif activity.level == 40: #added the recipient as friend
-            notify.send(actor,
-                        recipient=activity.content_object.parent.user,
-                        verb=u'friendship')
-        elif activity.level == 41: #mentionned the recipient in a discussion
-            mentionned_profile = MakerScienceProfile.objects.get(slug=activity.detail)
-            notify.send(actor,
-                        recipient=mentionned_profile.parent.user,
-                        verb=u'mentionned',
+import threading
+import traceback
+
+NOTIFICATION_FROM_EMAIL = 'Makerscience <no-reply@makerscience.fr>'
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+OUTBOX_RETRY_DELAY = getattr(settings, 'OUTBOX_RETRY_DELAY', 60) # seconds, doubled after each failed attempt
+OUTBOX_CLAIM_TIMEOUT = getattr(settings, 'OUTBOX_CLAIM_TIMEOUT', 10 * 60) # seconds
+
+class OutgoingEmail(models.Model):
+    """
+    Email waiting in the outbox, sent by the send_queued_emails command
+    """
+    STATUS_CHOICES = (
+        ('PENDING', 'En attente'),
+        ('SENDING', 'En cours d\'envoi'),
+        ('SENT', 'Envoyé'),
+        ('FAILED', 'En erreur'),
+    )
+
+    subject = models.CharField(max_length=255)
+    from_email = models.CharField(max_length=255)
+    to = models.CharField(max_length=255)
+    text_content = models.TextField()
+    html_content = models.TextField(blank=True)
+
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=datetime.now)
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    sent_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = (('status', 'next_attempt_on'),)
+
+    def to_message(self):
+        msg = EmailMultiAlternatives(self.subject, self.text_content, self.from_email, [self.to])
+        if self.html_content:
+            msg.attach_alternative(self.html_content, "text/html")
+        return msg
+
+    def mark_failed(self, error):
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= OUTBOX_MAX_ATTEMPTS:
+            self.status = 'FAILED'
+        else:
+            self.status = 'PENDING'
+            self.next_attempt_on = datetime.now() + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1))
+        self.save()
+
+
+def queue_email(subject, to, text_content, html_content='', from_email=NOTIFICATION_FROM_EMAIL):
+    return OutgoingEmail.objects.create(subject=subject, to=to, from_email=from_email,
+                                        text_content=text_content, html_content=html_content)
+
+def claim_queued_emails(batch_size):
+    """
+    Return the next emails to send, switched to SENDING so that an overlapping run skips them.
+    The emails of a crashed run are claimed again once OUTBOX_CLAIM_TIMEOUT has expired.
+    """
+    now = datetime.now()
+    with transaction.atomic():
+        batch = list(OutgoingEmail.objects.select_for_update()
+                                          .filter(status__in=['PENDING', 'SENDING'], next_attempt_on__lte=now)
+                                          .order_by('id')[:batch_size])
+        OutgoingEmail.objects.filter(id__in=[email.id for email in batch])\
+                             .update(status='SENDING', next_attempt_on=now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT))
+    return batch
+
+def send_queued_emails(batch_size=100):
+    """
+    Drain the outbox, batch by batch, over a single SMTP connection.
+    Each email is marked as sent as soon as the SMTP server accepted it,
+    failed emails are retried later with an exponential backoff.
+    Return the number of sent and failed emails.
+    """
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        while True:
+            batch = claim_queued_emails(batch_size)
+            if not batch:
+                break
+
+            for email in batch:
+                try:
+                    # Opening the connection ourselves keeps it alive across send_messages calls
+                    connection.open()
+                    connection.send_messages([email.to_message()])
+                except Exception:
+                    email.mark_failed(traceback.format_exc())
+                    failed += 1
+                    connection.close()
+                else:
+                    OutgoingEmail.objects.filter(id=email.id).update(status='SENT', sent_on=datetime.now())
+                    sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def get_recipient_ids(actor, **link_filters):
+    """
+    Return in one query the ids of the users whose makerscience profile
+    has a link matching link_filters, the actor excepted
+    """
+    profile_ids = ObjectProfileLink.objects.filter(**link_filters).values('profile')
+    return User.objects.filter(profile__in=profile_ids, profile__makerscienceprofile__isnull=False)\
+                       .exclude(profile=actor.parent_id)\
+                       .distinct().values_list('id', flat=True)
+
+# Recipients notified by the current thread, collected while deferred_publications is active
+_notified = threading.local()
+
+class NotifiedRecipients(object):
+    """
+    Recipients of new notifications, and of updated ones whose unread count does not change
+    """
+    def __init__(self):
+        self.new_ids = []
+        self.updated_ids = []
+
+    def publish(self):
+        incr_unread_counts(self.new_ids)
+        if self.new_ids or self.updated_ids:
+            publish_notifications(set(self.new_ids) | set(self.updated_ids))
+
+@contextmanager
+def deferred_publications():
+    """
+    Collect the recipients notified within the block instead of publishing them right away,
+    the caller publishes them once the notifications are committed
+    """
+    _notified.recipients = NotifiedRecipients()
+    try:
+        yield _notified.recipients
+    finally:
+        del _notified.recipients
+
+def publish_recipients(new_ids=(), updated_ids=()):
+    recipients = getattr(_notified, 'recipients', None)
+    if recipients is None:
+        recipients = NotifiedRecipients()
+        recipients.new_ids.extend(new_ids)
+        recipients.updated_ids.extend(updated_ids)
+        recipients.publish()
+    else:
+        recipients.new_ids.extend(new_ids)
+        recipients.updated_ids.extend(updated_ids)
+
+COALESCED_VERBS = getattr(settings, 'NOTIFICATION_COALESCED_VERBS', (u'liked', u'commented', u'scored'))
+NOTIFICATION_COALESCE_WINDOW = getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 60 * 60) # seconds, 0 disables coalescing
+
+def actor_key(notif):
+    return '%s:%s' % (notif.actor_content_type_id, notif.actor_object_id)
+
+def coalesce_notifications(notif, recipient_ids):
+    """
+    Merge notif into the unread notifications of the same verb and action object
+    received in the coalescing window, which then read "actor and N others",
+    N counting the distinct actors. A merged notification is inserted again under
+    a new id, so that the clients reading from an id cursor get it.
+    Return the ids of the recipients that still need a notification.
+    """
+    pending = Notification.objects.filter(recipient__in=recipient_ids,
+                                          unread=True,
+                                          verb=notif.verb,
+                                          action_object_content_type=notif.action_object_content_type_id,
+                                          action_object_object_id=notif.action_object_object_id,
+                                          timestamp__gte=notif.timestamp - timedelta(seconds=NOTIFICATION_COALESCE_WINDOW))\
+                                  .order_by('-timestamp')
+
+    coalesced_recipients = set()
+    replaced_ids = []
+    replacements = []
+    for existing in pending:
+        if existing.recipient_id in coalesced_recipients:
+            continue
+        coalesced_recipients.add(existing.recipient_id)
+        data = existing.data or {}
+        actors = data.get('actors') or [actor_key(existing)]
+        if actor_key(notif) in actors:
+            # Already counted, the notification is left as it is
+            continue
+
+        # The latest actor is the one displayed
+        values = dict((field.attname, getattr(existing, field.attname)) for field in Notification._meta.fields if not field.primary_key)
+        values.update(actor_content_type_id=notif.actor_content_type_id,
+                      actor_object_id=notif.actor_object_id,
+                      timestamp=notif.timestamp,
+                      data={'others_count' : data.get('others_count', len(actors) - 1) + 1, 'actors' : actors + [actor_key(notif)]})
+        replacements.append(Notification(**values))
+        replaced_ids.append(existing.id)
+
+    if replacements:
+        # One unread notification replaces another, the unread counts do not change
+        Notification.objects.bulk_create(replacements)
+        delete_notifications(replaced_ids)
+        forget_notification_descriptions(replaced_ids)
+        publish_recipients(updated_ids=[replacement.recipient_id for replacement in replacements])
+
+    return [recipient_id for recipient_id in recipient_ids if recipient_id not in coalesced_recipients]
+
+def notify_many(actor, recipient_ids, verb, action_object=None, target=None):
+    """
+    Notify every recipient of the same event with a single insert.
+    Descriptions are rendered when first read, see get_notification_descriptions.
+    """
+    recipient_ids = list(recipient_ids)
+    if not recipient_ids:
+        return []
+
+    notif = Notification(verb=verb, timestamp=now())
+    notif.actor = actor
+    if action_object is not None:
+        notif.action_object = action_object
+    if target is not None:
+        notif.target = target
+
+    if verb in COALESCED_VERBS and NOTIFICATION_COALESCE_WINDOW:
+        recipient_ids = coalesce_notifications(notif, recipient_ids)
+        if not recipient_ids:
+            return []
+
+    values = dict((field.attname, getattr(notif, field.attname)) for field in Notification._meta.fields
+                  if not field.primary_key and field.name != 'recipient')
+    notifications = [Notification(recipient_id=recipient_id, **values) for recipient_id in recipient_ids]
+    Notification.objects.bulk_create(notifications)
+    # bulk_create does not send post_save
+    publish_recipients(new_ids=recipient_ids)
+    return notifications
+
+def dispatch_notifications(activity, level=None, is_validated=None):
+    """
+    Notify the members concerned by a new activity.
+    level and is_validated are the values of the activity when it was recorded,
+    the link may have been validated since.
+    """
+    if level is None:
+        level = activity.level
+    if is_validated is None:
+        is_validated = activity.isValidated
+
+    actor = MakerScienceProfile.objects.select_related('parent').get(parent=activity.profile_id)
+
+    linked_to_content = {
+        'content_type' : activity.content_type_id,
+        'object_id' : activity.object_id,
+    }
+    following_actor = {
+        'level' : 40,
+        'content_type' : ContentType.objects.get_for_model(actor),
+        'object_id' : actor.id,
+    }
+
+    if level == 50:
+        tag = activity.content_object.tag
+        notify_many(actor,
+                    get_recipient_ids(actor, level=51, content_type=ContentType.objects.get_for_model(tag), object_id=tag.id),
+                    u'tagged',
+                    action_object=tag,
+                    target=activity.content_object.content_object)
+    elif level == 0:
+        if is_validated == False: #someome ask to join project team
+            notify_many(actor,
+                        get_recipient_ids(actor, level=0, isValidated=True, **linked_to_content),
+                        u'team_requested',
                         target=activity.content_object)
+        else :#someone has created a project
+            notify_many(actor,
+                        get_recipient_ids(actor, **following_actor),
+                        u'created',
+                        action_object=activity.content_object)
+    elif level == 1:
+        notify_many(actor,
+                    get_recipient_ids(actor, level=0, isValidated=True, **linked_to_content),
+                    u'help_proposed',
+                    target=activity.content_object)
+    elif level == 10:
+        if is_validated == False: #someome ask to join project team
+            notify_many(actor,
+                        get_recipient_ids(actor, level=10, isValidated=True, **linked_to_content),
+                        u'coauthor_requested',
+                        target=activity.content_object)
+        else :#someone has created a project
+            notify_many(actor,
+                        get_recipient_ids(actor, **following_actor),
+                        u'created',
+                        action_object=activity.content_object)
+    elif level == 11:
+        notify_many(actor,
+                    get_recipient_ids(actor, level=10, isValidated=True, **linked_to_content),
+                    u'similars_shared',
+                    target=activity.content_object)
+    elif level == 5: #someone has been invited to join  a project team
+        notify_many(get_profile_by_slug(activity.detail).as_profile(),
+                    [actor.parent.user_id],
+                    u'team_invited',
+                    target=activity.content_object)
+    elif level == 6: #someone has been invited to help  a project team
+        notify_many(get_profile_by_slug(activity.detail).as_profile(),
+                    [actor.parent.user_id],
+                    u'help_invited',
+                    target=activity.content_object)
+    elif level == 7: #someone added a news to a project
+        notify_many(actor,
+                    get_recipient_ids(actor, level__in=[0, 1, 2], isValidated=True, **linked_to_content),
+                    u'annonced',
+                    target=activity.content_object)
+    elif level == 15: #someone has been invited to join  co-author
+        notify_many(get_profile_by_slug(activity.detail).as_profile(),
+                    [actor.parent.user_id],
+                    u'coauthor_invited',
+                    target=activity.content_object)
+    elif level == 16: #someone has been invited to shared his similar resource
+        notify_many(get_profile_by_slug(activity.detail).as_profile(),
+                    [actor.parent.user_id],
+                    u'similar_resource_invited',
+                    target=activity.content_object)
+    elif level in [2, 12, 33]: #liked content where the recipient is involved (creator, member)
+        target_levels = {
+            2 : [0, 1],
+            12 : [10, 11],
+            33 : [30, 31]
+        }
+        notify_many(actor,
+                    get_recipient_ids(actor, level__in=target_levels[level], isValidated=True, **linked_to_content),
+                    u'liked',
+                    action_object=activity.content_object)
+    elif level in [3, 13]: #commented content where the recipient is involved (creator, member)
+        target_level = 0 if level == 3 else 10
+        notify_many(actor,
+                    get_recipient_ids(actor, level=target_level, isValidated=True, **linked_to_content),
+                    u'commented',
+                    action_object=activity.content_object)
+    elif level in [4, 14]: #scored content where the recipient is involved (creator, member)
+        target_level = 0 if level == 4 else 10
+        notify_many(actor,
+                    get_recipient_ids(actor, level=target_level, isValidated=True, **linked_to_content),
+                    u'scored',
+                    action_object=activity.content_object)
+    elif level == 40: #added the recipient as friend
+        notify_many(actor,
+                    [activity.content_object.parent.user_id],
+                    u'friendship')
+    elif level == 41: #mentionned the recipient in a discussion
+        mentionned_profile = get_profile_by_slug(activity.detail)
+        notify_many(actor,
+                    [mentionned_profile.user_id],
+                    u'mentionned',
+                    target=activity.content_object)
+
+
+UNREAD_COUNT_CACHE_TIMEOUT = getattr(settings, 'UNREAD_COUNT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+def unread_count_key(user_id):
+    return 'ms_notif_unread_%s' % user_id
+
+def get_unread_count(user_id):
+    """
+    Return the number of unread notifications of a user, counted once then kept in sync in the cache
+    """
+    count = cache.get(unread_count_key(user_id))
+    count_cache_lookups('unread_count', int(count is not None), int(count is None))
+    if count is None:
+        count = Notification.objects.filter(recipient=user_id, unread=True).count()
+        cache.set(unread_count_key(user_id), count, UNREAD_COUNT_CACHE_TIMEOUT)
+    return count
+
+def incr_unread_counts(user_ids):
+    for user_id in user_ids:
+        try:
+            cache.incr(unread_count_key(user_id))
+        except ValueError:
+            # Not counted yet, it will be on the next read
+            pass
+
+def forget_unread_counts(user_ids):
+    cache.delete_many([unread_count_key(user_id) for user_id in user_ids])
+
+def mark_all_as_read(user_id):
+    """
+    Mark every notification of a user as read with a single UPDATE
+    """
+    updated = Notification.objects.filter(recipient=user_id, unread=True).update(unread=False)
+    cache.set(unread_count_key(user_id), 0, UNREAD_COUNT_CACHE_TIMEOUT)
+    return updated
+
+def update_unread_count(sender, instance, created, **kwargs):
+    if created and instance.unread:
+        incr_unread_counts([instance.recipient_id])
+        publish_notifications([instance.recipient_id], instance.id)
+    else:
+        forget_unread_counts([instance.recipient_id])
+
+def clear_unread_count(sender, instance, **kwargs):
+    forget_unread_counts([instance.recipient_id])
+
+post_save.connect(update_unread_count, sender=Notification)
+post_delete.connect(clear_unread_count, sender=Notification)
+
+
+NOTIFICATION_EVENT_MAX_ATTEMPTS = getattr(settings, 'NOTIFICATION_EVENT_MAX_ATTEMPTS', 5)
+NOTIFICATION_EVENT_RETRY_DELAY = getattr(settings, 'NOTIFICATION_EVENT_RETRY_DELAY', 60) # seconds, doubled after each failed attempt
+NOTIFICATION_EVENT_CLAIM_TIMEOUT = getattr(settings, 'NOTIFICATION_EVENT_CLAIM_TIMEOUT', 10 * 60) # seconds
+
+class NotificationEvent(models.Model):
+    """
+    New activity whose notifications are waiting to be dispatched by the
+    process_notification_events command. The level and validation of the
+    activity are copied when it is recorded, the link may change before dispatch.
+    """
+    activity = models.ForeignKey(ObjectProfileLink, related_name='+')
+    level = models.IntegerField(null=True)
+    is_validated = models.NullBooleanField()
+    created_on = models.DateTimeField(auto_now_add=True)
+    processed_on = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=datetime.now)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = (('processed_on', 'next_attempt_on'),)
+
+    def mark_failed(self, error):
+        # Left pending, retried with an exponential backoff until NOTIFICATION_EVENT_MAX_ATTEMPTS
+        self.attempts += 1
+        self.error = error
+        self.next_attempt_on = datetime.now() + timedelta(seconds=NOTIFICATION_EVENT_RETRY_DELAY * 2 ** (self.attempts - 1))
+        NotificationEvent.objects.filter(id=self.id).update(attempts=self.attempts, error=error, next_attempt_on=self.next_attempt_on)
+
+def record_notification_event(sender, instance, created, **kwargs):
+    # Written in the saving transaction, so the worker only sees it once the activity is committed
+    if created:
+        NotificationEvent.objects.create(activity=instance, level=instance.level, is_validated=instance.isValidated)
+
+post_save.connect(record_notification_event, sender=ObjectProfileLink)
+
+def claim_notification_events(batch_size):
+    """
+    Return the next pending events, pushing their next attempt past the claim timeout
+    so that an overlapping run skips them. Events of a crashed run are claimed again once it expires.
+    """
+    now = datetime.now()
+    with transaction.atomic():
+        events = list(NotificationEvent.objects.select_for_update()
+                                               .filter(processed_on__isnull=True,
+                                                       attempts__lt=NOTIFICATION_EVENT_MAX_ATTEMPTS,
+                                                       next_attempt_on__lte=now)
+                                               .order_by('id')[:batch_size])
+        NotificationEvent.objects.filter(id__in=[event.id for event in events])\
+                                 .update(next_attempt_on=now + timedelta(seconds=NOTIFICATION_EVENT_CLAIM_TIMEOUT))
+    return events
+
+def process_notification_events(batch_size=100):
+    """
+    Dispatch the notifications of the pending events, batch by batch.
+    Failed events stay pending and are retried by a later run.
+    Return the number of processed and failed events.
+    """
+    processed = failed = 0
+    while True:
+        events = claim_notification_events(batch_size)
+        if not events:
+            break
+
+        activities = ObjectProfileLink.objects.in_bulk([event.activity_id for event in events])
+        for event in events:
+            try:
+                # Notifications and processed_on are committed together, a retry does not notify twice.
+                # Unread counts and live clients are only told once committed.
+                with deferred_publications() as recipients:
+                    with transaction.atomic():
+                        if event.activity_id in activities:
+                            dispatch_notifications(activities[event.activity_id], event.level, event.is_validated)
+                        NotificationEvent.objects.filter(id=event.id).update(processed_on=datetime.now())
+                    recipients.publish()
+                processed += 1
+            except Exception:
+                event.mark_failed(traceback.format_exc())
+                failed += 1
+    return processed, failed
+
+
+NOTIFICATION_RETENTION_DAYS = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 180)
+NOTIFICATION_GENERIC_RELATIONS = (
+    ('actor_content_type', 'actor_object_id'),
+    ('target_content_type', 'target_object_id'),
+    ('action_object_content_type', 'action_object_object_id'),
+)
+
+class ArchivedNotification(models.Model):
+    """
+    Compact copy of an old read notification, moved out of the notifications table by archive_notifications
+    """
+    notification_id = models.IntegerField(unique=True)
+    recipient = models.ForeignKey(User, related_name='+')
+    verb = models.CharField(max_length=255)
+    actor_content_type = models.ForeignKey(ContentType, related_name='+')
+    actor_object_id = models.CharField(max_length=255)
+    target_content_type = models.ForeignKey(ContentType, related_name='+', null=True, blank=True)
+    target_object_id = models.CharField(max_length=255, null=True, blank=True)
+    action_object_content_type = models.ForeignKey(ContentType, related_name='+', null=True, blank=True)
+    action_object_object_id = models.CharField(max_length=255, null=True, blank=True)
+    others_count = models.PositiveIntegerField(default=0)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        index_together = (('recipient', 'timestamp'),)
+
+    @classmethod
+    def from_notification(cls, notif):
+        values = dict((field, getattr(notif, field)) for field in ('recipient_id', 'verb', 'timestamp',
+                                                                     'actor_content_type_id', 'actor_object_id',
+                                                                     'target_content_type_id', 'target_object_id',
+                                                                     'action_object_content_type_id', 'action_object_object_id'))
+        return cls(notification_id=notif.id, others_count=(notif.data or {}).get('others_count', 0), **values)
+
+def delete_notifications(notif_ids):
+    # Raw delete, the collector would select each row again only to send post_delete
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE id = ANY(%%s)" % Notification._meta.db_table, [list(notif_ids)])
+
+def archive_notifications(days=NOTIFICATION_RETENTION_DAYS, batch_size=1000):
+    """
+    Move the read notifications older than days to the archive table, batch by batch.
+    Return the number of archived notifications.
+    """
+    archivable = Notification.objects.filter(unread=False, timestamp__lt=datetime.now() - timedelta(days=days))
+    archived = 0
+    while True:
+        batch = list(archivable.order_by('id')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            ArchivedNotification.objects.bulk_create([ArchivedNotification.from_notification(notif) for notif in batch])
+            delete_notifications([notif.id for notif in batch])
+        archived += len(batch)
+    return archived
+
+def prune_orphan_notifications(batch_size=1000, dry_run=False):
+    """
+    Delete the notifications whose actor, target or action object no longer exists.
+    object_id columns are strings, so the existing objects are looked up by chunks
+    of notifications rather than with a join.
+    Return the number of orphan notifications.
+    """
+    pruned = 0
+    for ct_field, id_field in NOTIFICATION_GENERIC_RELATIONS:
+        content_type_ids = Notification.objects.filter(**{'%s__isnull' % ct_field : False})\
+                                               .order_by().values_list(ct_field, flat=True).distinct()
+        for content_type in ContentType.objects.filter(id__in=list(content_type_ids)):
+            model = content_type.model_class()
+            last_id = 0
+            while True:
+                rows = list(Notification.objects.filter(**{ct_field : content_type, 'id__gt' : last_id})
+                                                .order_by('id')
+                                                .values_list('id', id_field, 'recipient')[:batch_size])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                existing = set()
+                if model is not None:
+                    existing = set(str(pk) for pk in model._base_manager.filter(pk__in=set(row[1] for row in rows))
+                                                                       .values_list('pk', flat=True))
+                orphans = [row for row in rows if row[1] not in existing]
+                if orphans and not dry_run:
+                    delete_notifications([row[0] for row in orphans])
+                    forget_unread_counts(set(row[2] for row in orphans))
+                pruned += len(orphans)
+    return pruned
+
+NOTIFICATION_TEMPLATE_VERSION = getattr(settings, 'NOTIFICATION_TEMPLATE_VERSION', 2)
+NOTIFICATION_DESCRIPTION_CACHE_TIMEOUT = getattr(settings, 'NOTIFICATION_DESCRIPTION_CACHE_TIMEOUT', 60 * 60 * 24 * 30)
+
+# Relations rendered by notifications/notification.html
+ACTOR_LOOKUPS = {MakerScienceProfile : ['parent__user']}
+TARGET_LOOKUPS = dict((model, ['parent']) for model in (MakerScienceProfile, MakerScienceProject, MakerScienceResource, MakerSciencePost))
+
+def notification_description_key(notif_id, base_url=''):
+    # Bump NOTIFICATION_TEMPLATE_VERSION when notifications/notification.html changes
+    return 'ms_notif_%s_%s_%s' % (NOTIFICATION_TEMPLATE_VERSION, notif_id, 'abs' if base_url else 'rel')
+
+def forget_notification_descriptions(notif_ids):
+    cache.delete_many([notification_description_key(notif_id, base_url)
+                       for notif_id in notif_ids
+                       for base_url in ('', settings.MAKERSCIENCE_BASE_URL)])
+
+def get_notification_descriptions(notifs, base_url=''):
+    """
+    Return the description of each notification, keyed by notification id.
+    Descriptions are rendered on first read and cached, the generic relations
+    of the notifications to render are fetched with one query per content type.
+    """
+    keys = dict((notification_description_key(notif.id, base_url), notif) for notif in notifs)
+    descriptions = cache.get_many(keys.keys())
+
+    missing = [notif for key, notif in keys.items() if key not in descriptions]
+    count_cache_lookups('notification_description', len(descriptions), len(missing))
+    if missing:
+        prefetch_related_objects(missing, ['actor', 'target', 'action_object'])
+        prefetch_related_per_model([notif.actor for notif in missing], ACTOR_LOOKUPS)
+        prefetch_related_per_model([notif.target for notif in missing] + [notif.action_object for notif in missing], TARGET_LOOKUPS)
+
+        rendered = {}
+        for notif in missing:
+            rendered[notification_description_key(notif.id, base_url)] = render_to_string('notifications/notification.html', {'notif': notif, 'base_url' : base_url})
+        cache.set_many(rendered, NOTIFICATION_DESCRIPTION_CACHE_TIMEOUT)
+        descriptions.update(rendered)
+
+    return dict((notif.id, descriptions[key]) for key, notif in keys.items())
+
+
+DIGEST_CHUNK_SIZE = getattr(settings, 'DIGEST_CHUNK_SIZE', 200)
+DIGEST_RENDER_PROCESSES = getattr(settings, 'DIGEST_RENDER_PROCESSES', 4)
+DIGEST_PERIODS = {
+    'DAILY' : timedelta(hours=24),
+    'WEEKLY' : timedelta(weeks=1),
+}
+
+class DigestRun(models.Model):
+    """
+    Checkpoint of a send_notifications_by_mail run, an interrupted run
+    resumes after the last profile whose digest was queued.
+    A run digests the notifications from since, the start of the previous run, to its own start.
+    """
+    frequency = models.CharField(max_length=6)
+    since = models.DateTimeField(null=True, blank=True)
+    started_on = models.DateTimeField(default=datetime.now)
+    finished_on = models.DateTimeField(null=True, blank=True)
+    last_profile_id = models.IntegerField(default=0)
+    queued = models.PositiveIntegerField(default=0)
+
+def render_digest(context):
+    # Runs in the rendering pool, the context only holds plain data so no query is made here
+    return (render_to_string('notifications/notif_multiple.txt', context),
+            render_to_string('notifications/notif_multiple.html', context))
+
+def get_digest_contexts(profiles, frequency, since, until):
+    """
+    Build the digest context of each profile having notifications between the given dates,
+    with one query for the notifications of all the profiles
+    """
+    notifs_by_user = defaultdict(list)
+    notifs = list(Notification.objects.filter(recipient__in=[profile.parent.user_id for profile in profiles],
+                                              timestamp__gte=since,
+                                              timestamp__lt=until)
+                                      .select_related('actor_content_type', 'target_content_type', 'action_object_content_type')
+                                      .order_by('-timestamp'))
+    descriptions = get_notification_descriptions(notifs, settings.MAKERSCIENCE_BASE_URL)
+    for notif in notifs:
+        notifs_by_user[notif.recipient_id].append({'description' : descriptions[notif.id], 'timestamp' : notif.timestamp})
+
+    contexts = []
+    for profile in profiles:
+        if notifs_by_user[profile.parent.user_id]:
+            contexts.append((profile.parent.user.email, {
+                'frequency' : frequency,
+                'notifs' : notifs_by_user[profile.parent.user_id],
+                'base_url' : settings.MAKERSCIENCE_BASE_URL,
+                'recipient' : {'slug' : profile.slug},
+            }))
+    return contexts
+
+def queue_digests(run, render_all=map):
+    """
+    Queue the digests of a run from its checkpoint, covering its window.
+    Return the number of digests queued.
+    """
+    # Runs created before since was stored cover the period before their start
+    since = run.since or run.started_on - DIGEST_PERIODS[run.frequency]
+    queued = 0
+    while True:
+        profiles = list(MakerScienceProfile.objects.filter(notif_subcription_freq=run.frequency, id__gt=run.last_profile_id)
+                                                   .select_related('parent__user')
+                                                   .order_by('id')[:DIGEST_CHUNK_SIZE])
+        if not profiles:
+            break
 
-post_save.connect(create_notification, sender=ObjectProfileLink)
+        contexts = get_digest_contexts(profiles, run.frequency, since, run.started_on)
+        rendered = render_all(render_digest, [context for to, context in contexts])
+        emails = [OutgoingEmail(subject="Notifications Makerscience", from_email=NOTIFICATION_FROM_EMAIL, to=to,
+                                text_content=text_content, html_content=html_content)
+                  for (to, context), (text_content, html_content) in zip(contexts, rendered)]
 
-def generate_notif_description(sender, instance, **kwargs):
-    instance.data = {'description' : render_to_string('notifications/notification.html', {'notif': instance})}
+        # Queued emails and checkpoint are committed together, a resumed run does not queue them twice
+        with transaction.atomic():
+            OutgoingEmail.objects.bulk_create(emails)
+            run.last_profile_id = profiles[-1].id
+            run.queued += len(emails)
+            run.save()
+        queued += len(emails)
 
-pre_save.connect(generate_notif_description, sender=Notification)
+    run.finished_on = datetime.now()
+    run.save()
+    return queued
 
+def create_digest_run(frequency):
+    """
+    Start a run whose window follows the previous run, without gap nor overlap
+    """
+    now = datetime.now()
+    previous_start = DigestRun.objects.filter(frequency=frequency).order_by('-started_on').values_list('started_on', flat=True).first()
+    return DigestRun.objects.create(frequency=frequency, since=previous_start or now - DIGEST_PERIODS[frequency], started_on=now)
 
 def send_notifications_by_mail(frequency):
-    for profile in MakerScienceProfile.objects.all():
-        notifs = profile.parent.user.notifications.all()
-        if profile.notif_subcription_freq == frequency:
-            if frequency == 'DAILY':
-                time_threshold = datetime.now() - timedelta(hours=24)
-            elif frequency == 'WEEKLY':
-                time_threshold = datetime.now() - timedelta(weeks=1)
-            notifs = notifs.filter(timestamp__gte=time_threshold)
-
-            if notifs.count() > 0 :
-                subject = "Notifications Makerscience"
-                from_email = 'Makerscience <no-reply@makerscience.fr>'
-                to = profile.parent.user.email
-                context = {
-                    'frequency' : frequency,
-                    'notifs' : notifs,
-                    'base_url' : settings.MAKERSCIENCE_BASE_URL,
-                    'recipient' : profile
-                }
-
-                text_content = render_to_string('notifications/notif_multiple.txt', context)
-                html_content = render_to_string('notifications/notif_multiple.html', context)
-                msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
-                msg.attach_alternative(html_content, "text/html")
-                msg.send()
+    """
+    Queue the notifications digest of the profiles subscribed to the given frequency.
+    Profiles are processed by chunks, digests being rendered in a process pool.
+    An interrupted run is first resumed from its checkpoint over its own window,
+    then a new run covers the notifications since the start of the previous one.
+    Emails are sent when the outbox is drained.
+    Return the number of digests queued.
+    """
+    pool = None
+    render_all = map
+    if DIGEST_RENDER_PROCESSES > 1:
+        # Forked workers must not share the parent database connection
+        connection.close()
+        pool = Pool(DIGEST_RENDER_PROCESSES)
+        render_all = pool.map
+    try:
+        queued = 0
+        run = DigestRun.objects.filter(frequency=frequency, finished_on__isnull=True).order_by('-id').first()
+        if run is not None:
+            queued += queue_digests(run, render_all)
+        queued += queue_digests(create_digest_run(frequency), render_all)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return queued
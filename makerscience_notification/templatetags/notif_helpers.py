@@ -1,9 +1,9 @@
 from django import template
 
-from makerscience_profile.models import MakerScienceProfile
+from makerscience_profile.models import get_profile_by_slug
 
 register = template.Library()
 
 @register.filter(name='profile_fullname')
 def profile_fullname(value):
-    return MakerScienceProfile.objects.get(slug=value).parent.get_full_name_or_username()
+    return get_profile_by_slug(value).full_name
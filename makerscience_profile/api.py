@@ -2,10 +2,10 @@
 
 from django.conf.urls import url
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.contrib.contenttypes.models import ContentType
 from django.template.loader import render_to_string
-from django.core.mail import EmailMultiAlternatives
 
 from haystack.query import SearchQuerySet
 
@@ -21,12 +21,13 @@ from accounts.models import ObjectProfileLink
 from scout.api import PlaceResource
 from graffiti.api import TaggedItemResource
 
-from makerscience_admin.api import SearchableMakerScienceResource
+from makerscience_admin.api import SearchableMakerScienceResource, PageViewsCounterResource, keyset_page
+from makerscience_admin.metrics import count_cache_lookups
 from makerscience_server.authorizations  import  MakerScienceAPIAuthorization
-from .models import MakerScienceProfile, MakerScienceProfileTaggedItem
+from makerscience_notification.models import queue_email
+from .models import MakerScienceProfile, MakerScienceProfileTaggedItem, MakerScienceAvatarJob, activity_cache_key, get_profiles_by_slug
 
 import json
-import os
 import requests
 
 from datetime import datetime
@@ -35,12 +36,59 @@ from Crypto.Hash import MD5
 
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 
-class MakerScienceProfileResourceLight(ModelResource, SearchableMakerScienceResource):
+ACTIVITIES_MAX_LIMIT = getattr(settings, 'ACTIVITIES_MAX_LIMIT', 50)
+ACTIVITY_CACHE_TIMEOUT = getattr(settings, 'ACTIVITY_CACHE_TIMEOUT', 60 * 60 * 24)
+
+def render_activities(activities, egocentric):
+    """
+    Return the HTML description of each activity, keyed by activity id.
+    Descriptions are cached per activity, only the missing ones are rendered.
+    """
+    keys = dict((activity_cache_key(activity.id, egocentric), activity) for activity in activities)
+    descriptions = cache.get_many(keys.keys())
+
+    # Mentions (level 41) display the mentionned profile, resolve them all at once
+    get_profiles_by_slug([activity.detail for key, activity in keys.items()
+                          if key not in descriptions and activity.level == 41 and activity.detail])
+
+    rendered = {}
+    for key, activity in keys.items():
+        if key not in descriptions:
+            rendered[key] = render_to_string('notifications/activity.html', {'activity': activity, 'egocentric': egocentric})
+    count_cache_lookups('activity', len(descriptions), len(rendered))
+    if rendered:
+        cache.set_many(rendered, ACTIVITY_CACHE_TIMEOUT)
+        descriptions.update(rendered)
+    return dict((activity.id, descriptions[key]) for key, activity in keys.items())
+
+def dehydrate_activities(request, activities, egocentric):
+    data = []
+    with_html = request.GET.get('html', 'true').lower() not in ('0', 'false')
+    descriptions = render_activities(activities, egocentric) if with_html else {}
+    for activity in activities:
+        activity_data = {
+            'id' : activity.id,
+            'level' : activity.level,
+            'detail' : activity.detail,
+            'content_type' : activity.content_type.model,
+            'object_id' : activity.object_id,
+            'profile_id' : activity.profile_id,
+            'profile_name' : activity.profile.get_full_name_or_username(),
+            'created_on' : activity.created_on,
+        }
+        if with_html:
+            activity_data['description'] = descriptions[activity.id]
+        data.append(activity_data)
+    return data
+
+class MakerScienceProfileResourceLight(PageViewsCounterResource, ModelResource, SearchableMakerScienceResource):
     parent_id = fields.IntegerField('parent__id')
     first_name = fields.CharField('parent__user__first_name')
     last_name = fields.CharField('parent__user__last_name')
     address_locality = fields.CharField('location__address__address_locality', null=True)
     avatar = fields.FileField("parent__mugshot", null=True, blank=True)
+    avatar_small = fields.FileField("avatar__small", null=True, blank=True)
+    avatar_medium = fields.FileField("avatar__medium", null=True, blank=True)
     date_joined = fields.DateField("parent__user__date_joined")
 
     class Meta:
@@ -60,6 +108,10 @@ class MakerScienceProfileResourceLight(ModelResource, SearchableMakerScienceReso
         }
         limit = 6
 
+    def get_object_list(self, request):
+        return super(MakerScienceProfileResourceLight, self).get_object_list(request)\
+                    .select_related('parent__user', 'location__address', 'avatar')
+
     def dehydrate(self, bundle):
         bundle.data["lng"] = bundle.obj.location.geo.x if bundle.obj.location.geo else ""
         bundle.data["lat"] = bundle.obj.location.geo.y if bundle.obj.location.geo else ""
@@ -80,9 +132,11 @@ class MakerScienceProfileAuthorization(MakerScienceAPIAuthorization):
             delete_permission_code="makerscience_profile.delete_makerscienceprofile"
         )
 
-class MakerScienceProfileResource(ModelResource, SearchableMakerScienceResource):
+class MakerScienceProfileResource(PageViewsCounterResource, ModelResource, SearchableMakerScienceResource):
     parent = fields.OneToOneField(ProfileResource, 'parent', full=True)
     location = fields.ToOneField(PlaceResource, 'location', null=True, blank=True, full=True)
+    avatar_small = fields.FileField("avatar__small", null=True, blank=True)
+    avatar_medium = fields.FileField("avatar__medium", null=True, blank=True)
 
     tags = fields.ToManyField('makerscience_profile.api.MakerScienceProfileTaggedItemResource', 'tagged_items', full=True, null=True, readonly=True)
 
@@ -102,6 +156,11 @@ class MakerScienceProfileResource(ModelResource, SearchableMakerScienceResource)
         }
         limit = 6
 
+    def get_object_list(self, request):
+        return super(MakerScienceProfileResource, self).get_object_list(request)\
+                    .select_related('parent__user', 'location__address', 'avatar')\
+                    .prefetch_related('tagged_items__tag')
+
     def dehydrate(self, bundle):
         bundle.data["full_name"] = "%s %s" % (bundle.obj.parent.user.first_name, bundle.obj.parent.user.last_name)
 
@@ -152,13 +211,10 @@ class MakerScienceProfileResource(ModelResource, SearchableMakerScienceResource)
         if resp["success"]:
             try:
                 subject = "Message de %s sur Makerscience" % sender_profile.parent.get_full_name_or_username()
-                from_email = 'Makerscience <no-reply@makerscience.fr>'
                 to = recipient_profile.parent.user.email
                 text_content = render_to_string('notifications/message.txt', {'sender' : sender_profile, 'body' : data["body"], 'recipient' : recipient_profile})
                 html_content = render_to_string('notifications/message.html', {'sender' : sender_profile, 'body' : data["body"], 'recipient' : recipient_profile})
-                msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
-                msg.attach_alternative(html_content, "text/html")
-                msg.send()
+                queue_email(subject, to, text_content, html_content)
             except:
                 return self.create_response(request, {'success': False, 'reason' : 'EMAIL_SENDING_FAIL'})
             return self.create_response(request, {'success': True})
@@ -191,13 +247,10 @@ class MakerScienceProfileResource(ModelResource, SearchableMakerScienceResource)
                 password_reset_url = u"%s/%s/?email=%s" % (settings.RESET_PASSWORD_URL, urlsafe_b64encode(aes.encrypt(email)), email.encode('utf-8'))
                 try:
                     subject = "Ré-initialisation de votre mot de passe sur Makerscience"
-                    from_email = 'Makerscience <no-reply@makerscience.fr>'
                     to = profile.parent.user.email
                     text_content = render_to_string('notifications/reset_password.txt', {'password_reset_url' : password_reset_url, 'recipient' : profile })
                     html_content = render_to_string('notifications/reset_password.html', {'password_reset_url' : password_reset_url, 'recipient' : profile })
-                    msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
-                    msg.attach_alternative(html_content, "text/html")
-                    msg.send()
+                    queue_email(subject, to, text_content, html_content)
                 except:
                     return self.create_response(request, {'success': False, 'reason' : 'EMAIL_SENDING_FAIL'})
                 return self.create_response(request, {'success': True, 'error' : 'EMAIL_SENT'})
@@ -229,47 +282,45 @@ class MakerScienceProfileResource(ModelResource, SearchableMakerScienceResource)
 
         profile = MakerScienceProfile.objects.get(slug=kwargs["slug"])
 
-        file = request.FILES['file']
-
-        old_file_path = None
-        if profile.parent.mugshot :
-            old_file_path = profile.parent.mugshot.path
-
-        profile.parent.mugshot = file
-        profile.parent.save()
-
-        if old_file_path and os.path.isfile(old_file_path):
-            os.remove(old_file_path)
+        # Thumbnails are generated by the process_avatar_jobs command
+        job = MakerScienceAvatarJob.objects.create(profile=profile, upload=request.FILES['file'])
 
+        # The upload is deleted once processed, the current avatar is returned until then
+        avatar = profile.avatar
         return self.create_response(request, {
-            'avatar': profile.parent.mugshot.url,
+            'avatar': avatar.original.url if avatar else (profile.parent.mugshot.url if profile.parent.mugshot else None),
+            'avatar_small': avatar.small.url if avatar and avatar.small else None,
+            'avatar_medium': avatar.medium.url if avatar and avatar.medium else None,
+            'job_id': job.id,
+            'status': job.status,
         })
 
+    def get_activities_limit(self, request):
+        try:
+            limit = int(request.GET.get('limit', self._meta.limit))
+        except ValueError:
+            limit = self._meta.limit
+        return min(max(limit, 1), ACTIVITIES_MAX_LIMIT)
+
     def get_profile_activities(self, request, **kwargs):
         self.method_check(request, allowed=['get'])
         self.throttle_check(request)
         self.is_authenticated(request)
 
-        limit = request.GET.get('limit', None)
+        limit = self.get_activities_limit(request)
 
         profile = MakerScienceProfile.objects.get(slug=kwargs["slug"])
 
-        activities = []
-        all_activities = ObjectProfileLink.objects.filter(profile=profile.parent, isValidated=True).order_by('-created_on')
-        for activity in all_activities:
-            activities.append({
-                'description' : render_to_string('notifications/activity.html', {'activity': activity, 'egocentric':True}),
-                'created_on' : activity.created_on
-            })
-            if limit and len(activities) == int(limit):
-                break
+        all_activities = ObjectProfileLink.objects.filter(profile=profile.parent, isValidated=True)\
+                                                  .select_related('profile__user', 'content_type')
+        activities, next_cursor = keyset_page(all_activities, request.GET.get('cursor', None), limit)
 
         return self.create_response(request, {
             'metadata' : {
-                'limit' : int(limit),
-                'total_count' : all_activities.count()
+                'limit' : limit,
+                'next' : next_cursor,
             },
-            'objects': activities,
+            'objects': dehydrate_activities(request, activities, egocentric=True),
         })
 
     def get_contacts_activities(self, request, **kwargs):
@@ -277,29 +328,19 @@ class MakerScienceProfileResource(ModelResource, SearchableMakerScienceResource)
         self.throttle_check(request)
         self.is_authenticated(request)
 
-        limit = request.GET.get('limit', None)
+        limit = self.get_activities_limit(request)
 
         profile = MakerScienceProfile.objects.get(slug=kwargs["slug"])
 
-        contact_ids = profile.parent.objectprofilelink_set.filter(level=40).values_list('object_id', flat=True) #Must return IDs of MakerScienceProfile
-        contact_ids = MakerScienceProfile.objects.filter(id__in=[int(i) for i in contact_ids]).values_list('parent__id', flat=True)
-
-        activities = []
-        all_activities = ObjectProfileLink.objects.filter(profile__in=contact_ids, isValidated=True).order_by('-created_on')
-        for activity in all_activities:
-            activities.append({
-                'description' : render_to_string('notifications/activity.html', {'activity': activity, 'egocentric':False}),
-                'created_on' : activity.created_on
-            })
-            if limit and len(activities) == int(limit):
-                break
+        timeline = profile.timeline.select_related('activity__profile__user', 'activity__content_type')
+        entries, next_cursor = keyset_page(timeline, request.GET.get('cursor', None), limit)
 
         return self.create_response(request, {
             'metadata' : {
-                'limit' : int(limit),
-                'total_count' : all_activities.count()
+                'limit' : limit,
+                'next' : next_cursor,
             },
-            'objects': activities,
+            'objects': dehydrate_activities(request, [entry.activity for entry in entries], egocentric=False),
         })
 
 class MakerScienceProfileTaggedItemResource(TaggedItemResource):
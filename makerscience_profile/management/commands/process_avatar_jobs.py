@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from makerscience_profile.models import MakerScienceAvatarJob
+
+class Command(BaseCommand):
+    help = "Generate the thumbnail variants of the uploaded avatars waiting in the job queue."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', '-l',
+                    dest='limit',
+                    type='int',
+                    default=100,
+                    help='Maximum number of jobs to process'),
+    )
+
+    def handle(self, *args, **options):
+        for job in MakerScienceAvatarJob.claim(options['limit']):
+            job.process()
+            print "Avatar job #%s : %s" % (job.id, job.status)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.contrib.contenttypes.models import ContentType
+
+from accounts.models import ObjectProfileLink
+from makerscience_profile.models import MakerScienceProfile, MakerScienceProfileTimelineEntry, backfill_timeline
+
+class Command(BaseCommand):
+    help = "Rebuild the contacts activity timeline of every MakerScienceProfile from the followed profiles activities."
+
+    def handle(self, *args, **options):
+        profile_type = ContentType.objects.get_for_model(MakerScienceProfile)
+
+        print "Rebuilding timelines ...",
+        MakerScienceProfileTimelineEntry.objects.all().delete()
+        for profile in MakerScienceProfile.objects.all().only('id', 'parent'):
+            # Every level 40 link is a follow, validated or not, as in fan_out_activity
+            followed_ids = ObjectProfileLink.objects.filter(level=40,
+                                                            content_type=profile_type,
+                                                            profile=profile.parent_id).values('object_id')
+            followed_parent_ids = MakerScienceProfile.objects.filter(id__in=followed_ids).values('parent')
+            backfill_timeline(profile, followed_parent_ids)
+        print "[OK]"
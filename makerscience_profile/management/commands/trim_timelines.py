@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+
+from makerscience_profile.models import trim_timelines, TIMELINE_MAX_LENGTH
+
+class Command(BaseCommand):
+    help = "Delete the oldest entries of the contacts activity timelines longer than TIMELINE_MAX_LENGTH."
+
+    def handle(self, *args, **options):
+        print "%s timeline entries deleted, %s kept per timeline" % (trim_timelines(), TIMELINE_MAX_LENGTH)
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 from django.contrib.auth.models import User, Group
+from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
-from django.db import models
-from django.db.models.signals import post_save, post_delete
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import models, connection, transaction, IntegrityError
+from django.core.signals import request_started
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch.dispatcher import receiver
 
 from taggit.models import TaggedItem
@@ -13,6 +17,19 @@ from autoslug import AutoSlugField
 from accounts.models import Profile, ObjectProfileLink
 from scout.models import PostalAddress, Place
 
+from makerscience_admin.metrics import count_cache_lookups
+from PIL import Image, ImageOps
+
+from StringIO import StringIO
+from collections import namedtuple
+
+from datetime import datetime, timedelta
+
+import hashlib
+import os
+import threading
+import traceback
+
 class MakerScienceProfileTaggedItem (TaggedItem):
     PROFILE_TAG_TYPE_CHOICES = (
         ('SK', 'Compétences'),
@@ -38,6 +55,7 @@ class MakerScienceProfile(models.Model):
     activity = models.CharField(max_length=255)
     bio = models.TextField(null=True, blank=True)
     location = models.ForeignKey(Place, null=True, blank=True, on_delete=models.SET_NULL)
+    avatar = models.ForeignKey('MakerScienceAvatar', null=True, blank=True, on_delete=models.SET_NULL)
     modified = models.DateTimeField(auto_now=True)
 
     tags = TaggableManager(through=MakerScienceProfileTaggedItem, blank=True)
@@ -99,3 +117,323 @@ def allow_user_to_create_MS_resources_and_project(sender, instance, created, *ar
             print permission
     # assign user to group
     instance.groups.add(group)
+
+
+PROFILE_SLUG_CACHE_TIMEOUT = getattr(settings, 'PROFILE_SLUG_CACHE_TIMEOUT', 60 * 60)
+
+# Profiles already resolved while handling the current request
+_resolved_profiles = threading.local()
+
+def profile_slug_cache_key(slug):
+    return 'ms_profile_summary_%s' % slug
+
+def profile_id_cache_key(profile_id):
+    return 'ms_profile_id_%s' % profile_id
+
+def get_resolved_profiles():
+    if not hasattr(_resolved_profiles, 'by_slug'):
+        _resolved_profiles.by_slug = {}
+    return _resolved_profiles.by_slug
+
+@receiver(request_started)
+def reset_resolved_profiles(sender, **kwargs):
+    _resolved_profiles.by_slug = {}
+
+class ProfileSummary(namedtuple('ProfileSummary', ['id', 'slug', 'full_name', 'user_id'])):
+    """
+    Fields of a MakerScienceProfile kept in the slug cache, nothing private is cached
+    """
+    @classmethod
+    def from_profile(cls, profile):
+        return cls(profile.id, profile.slug, profile.parent.get_full_name_or_username(), profile.parent.user_id)
+
+    def as_profile(self):
+        # Enough for the generic relations, which only need the model and the id
+        return MakerScienceProfile(id=self.id, slug=self.slug)
+
+def get_profiles_by_slug(slugs):
+    """
+    Return the ProfileSummary of each slug, keyed by slug.
+    Slugs are looked up in the request memo, then in the shared cache, and all
+    the remaining ones are fetched with a single query. Unknown slugs are left out.
+    """
+    resolved = get_resolved_profiles()
+    slugs = set(slugs)
+    profiles = dict((slug, resolved[slug]) for slug in slugs if slug in resolved)
+
+    missing = slugs - set(profiles)
+    if missing:
+        cached = cache.get_many([profile_slug_cache_key(slug) for slug in missing])
+        count_cache_lookups('profile_slug', len(cached), len(missing) - len(cached))
+        for slug in list(missing):
+            if profile_slug_cache_key(slug) in cached:
+                profiles[slug] = cached[profile_slug_cache_key(slug)]
+                missing.remove(slug)
+
+    if missing:
+        to_cache = {}
+        for profile in MakerScienceProfile.objects.filter(slug__in=missing).select_related('parent__user'):
+            summary = ProfileSummary.from_profile(profile)
+            profiles[profile.slug] = summary
+            to_cache[profile_slug_cache_key(profile.slug)] = summary
+            to_cache[profile_id_cache_key(profile.id)] = profile.slug
+        cache.set_many(to_cache, PROFILE_SLUG_CACHE_TIMEOUT)
+
+    resolved.update(profiles)
+    return profiles
+
+def get_profile_by_slug(slug):
+    try:
+        return get_profiles_by_slug([slug])[slug]
+    except KeyError:
+        raise MakerScienceProfile.DoesNotExist("No MakerScienceProfile with slug %s" % slug)
+
+def forget_profiles(profile_ids):
+    """
+    Drop the given profiles from the slug memo and cache, under their current and previous slugs
+    """
+    resolved = get_resolved_profiles()
+    keys = []
+    for slug, profile in resolved.items():
+        if profile.id in profile_ids:
+            del resolved[slug]
+            keys.append(profile_slug_cache_key(slug))
+    for profile_id, slug in cache.get_many([profile_id_cache_key(i) for i in profile_ids]).items():
+        keys.extend([profile_id, profile_slug_cache_key(slug)])
+    cache.delete_many(keys)
+
+@receiver(post_save, sender=MakerScienceProfile)
+def forget_saved_profile(sender, instance, **kwargs):
+    forget_profiles([instance.id])
+    cache.delete(profile_slug_cache_key(instance.slug))
+
+USER_NAME_FIELDS = ('first_name', 'last_name', 'username')
+
+def get_user_name(user):
+    # Read from __dict__, deferred fields must not be loaded for this
+    return tuple(user.__dict__.get(field) for field in USER_NAME_FIELDS)
+
+@receiver(post_init, sender=User)
+def remember_user_name(sender, instance, **kwargs):
+    instance._profile_user_name = get_user_name(instance)
+
+@receiver(post_save, sender=User)
+def forget_renamed_profiles(sender, instance, created, **kwargs):
+    # Full names are read from the user, other saves (such as the last_login update) leave the cache alone
+    name = get_user_name(instance)
+    if created or name == getattr(instance, '_profile_user_name', None):
+        return
+    instance._profile_user_name = name
+    forget_profiles(list(MakerScienceProfile.objects.filter(parent__user=instance).values_list('id', flat=True)))
+
+
+def activity_cache_key(activity_id, egocentric):
+    return 'ms_activity_%s_%d' % (activity_id, egocentric)
+
+@receiver(post_save, sender=ObjectProfileLink)
+@receiver(post_delete, sender=ObjectProfileLink)
+def clear_activity_cache(sender, instance, **kwargs):
+    cache.delete_many([activity_cache_key(instance.id, egocentric) for egocentric in (True, False)])
+
+
+TIMELINE_MAX_LENGTH = getattr(settings, 'TIMELINE_MAX_LENGTH', 500)
+
+class MakerScienceProfileTimelineEntry(models.Model):
+    """
+    Activity of a followed profile, copied into the timeline of each follower
+    when it happens so that reading the contacts feed is a single range query
+    """
+    owner = models.ForeignKey(MakerScienceProfile, related_name='timeline')
+    activity = models.ForeignKey(ObjectProfileLink, related_name='+')
+    created_on = models.DateTimeField()
+
+    class Meta:
+        unique_together = (('owner', 'activity'),)
+        index_together = (('owner', 'created_on', 'id'),)
+
+
+def trim_timelines():
+    """
+    Keep only the TIMELINE_MAX_LENGTH most recent entries of the timelines longer than that.
+    Run periodically by the trim_timelines command, timelines may grow past the limit in between.
+    Return the number of deleted entries.
+    """
+    table = MakerScienceProfileTimelineEntry._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute("""DELETE FROM %(table)s WHERE id IN (
+                          SELECT id FROM (
+                              SELECT id, row_number() OVER (PARTITION BY owner_id ORDER BY created_on DESC, id DESC) AS position
+                              FROM %(table)s WHERE owner_id IN (
+                                  SELECT owner_id FROM %(table)s GROUP BY owner_id HAVING COUNT(*) > %%s
+                              )
+                          ) AS ranked WHERE position > %%s)""" % {'table' : table},
+                   [TIMELINE_MAX_LENGTH, TIMELINE_MAX_LENGTH])
+    return cursor.rowcount
+
+def fan_out_activity(activity):
+    """
+    Push activity into the timeline of every profile following its author
+    """
+    author_ids = MakerScienceProfile.objects.filter(parent=activity.profile_id).values('id')
+    # Every level 40 link is a follow, validated or not, as in rebuild_timelines and update_timelines
+    follower_parent_ids = ObjectProfileLink.objects.filter(level=40,
+                                                           content_type=ContentType.objects.get_for_model(MakerScienceProfile),
+                                                           object_id__in=author_ids).values('profile')
+    follower_ids = MakerScienceProfile.objects.filter(parent__in=follower_parent_ids)\
+                                              .exclude(timeline__activity=activity)\
+                                              .values_list('id', flat=True)
+    follower_ids = list(follower_ids)
+    if follower_ids:
+        MakerScienceProfileTimelineEntry.objects.bulk_create([
+            MakerScienceProfileTimelineEntry(owner_id=follower_id, activity=activity, created_on=activity.created_on)
+            for follower_id in follower_ids
+        ])
+
+def backfill_timeline(owner, followed_parent_ids):
+    """
+    Copy the latest activities of the followed profiles into the timeline of owner
+    """
+    activities = ObjectProfileLink.objects.filter(profile__in=followed_parent_ids, isValidated=True)\
+                                          .exclude(id__in=owner.timeline.values('activity'))\
+                                          .order_by('-created_on', '-id')\
+                                          .values_list('id', 'created_on')[:TIMELINE_MAX_LENGTH]
+    MakerScienceProfileTimelineEntry.objects.bulk_create([
+        MakerScienceProfileTimelineEntry(owner=owner, activity_id=activity_id, created_on=created_on)
+        for activity_id, created_on in activities
+    ])
+
+def is_profile_follow(link):
+    return link.level == 40 and link.content_type_id == ContentType.objects.get_for_model(MakerScienceProfile).id
+
+@receiver(post_save, sender=ObjectProfileLink)
+def update_timelines(sender, instance, created, **kwargs):
+    # Only validated activities are shown, but a follow counts as soon as it is created
+    if instance.isValidated:
+        fan_out_activity(instance)
+    elif not created:
+        MakerScienceProfileTimelineEntry.objects.filter(activity=instance).delete()
+    if created and is_profile_follow(instance):
+        followed_parent_ids = MakerScienceProfile.objects.filter(id=instance.object_id).values('parent')
+        for follower in MakerScienceProfile.objects.filter(parent=instance.profile_id):
+            backfill_timeline(follower, followed_parent_ids)
+
+@receiver(post_delete, sender=ObjectProfileLink)
+def clear_unfollowed_timeline(sender, instance, **kwargs):
+    if is_profile_follow(instance):
+        followed_parent_ids = MakerScienceProfile.objects.filter(id=instance.object_id).values('parent')
+        MakerScienceProfileTimelineEntry.objects.filter(owner__parent=instance.profile_id,
+                                                        activity__profile__in=followed_parent_ids).delete()
+
+
+class MakerScienceAvatar(models.Model):
+    """
+    Avatar image and its thumbnail variants, shared by every upload with the same content
+    """
+    VARIANT_SIZES = (
+        ('small', (48, 48)),
+        ('medium', (160, 160)),
+    )
+
+    content_hash = models.CharField(max_length=40, unique=True)
+    original = models.ImageField(upload_to='avatars')
+    small = models.ImageField(upload_to='avatars/small', blank=True)
+    medium = models.ImageField(upload_to='avatars/medium', blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return self.content_hash
+
+    @classmethod
+    def from_content(cls, content, extension):
+        """
+        Return the avatar matching content, generating its variants if it is a new image
+        """
+        content_hash = hashlib.sha1(content).hexdigest()
+        try:
+            return cls.objects.get(content_hash=content_hash)
+        except cls.DoesNotExist:
+            pass
+
+        avatar = cls(content_hash=content_hash)
+        avatar.original.save(content_hash + extension, ContentFile(content), save=False)
+
+        image = Image.open(StringIO(content)).convert('RGB')
+        for variant, size in cls.VARIANT_SIZES:
+            thumbnail = StringIO()
+            ImageOps.fit(image, size, Image.ANTIALIAS).save(thumbnail, 'JPEG', quality=85)
+            getattr(avatar, variant).save('%s.jpg' % content_hash, ContentFile(thumbnail.getvalue()), save=False)
+        try:
+            with transaction.atomic():
+                avatar.save()
+        except IntegrityError:
+            # The same image was stored meanwhile by another job, its files are kept
+            existing = cls.objects.get(content_hash=content_hash)
+            for field in ('original', 'small', 'medium'):
+                name = getattr(avatar, field).name
+                if name and name != getattr(existing, field).name:
+                    getattr(avatar, field).storage.delete(name)
+            return existing
+        return avatar
+
+
+AVATAR_JOB_CLAIM_TIMEOUT = getattr(settings, 'AVATAR_JOB_CLAIM_TIMEOUT', 10 * 60) # seconds
+
+class MakerScienceAvatarJob(models.Model):
+    """
+    Uploaded avatar waiting to be processed by the process_avatar_jobs command
+    """
+    STATUS_CHOICES = (
+        ('PENDING', 'En attente'),
+        ('RUNNING', 'En cours'),
+        ('DONE', 'Traité'),
+        ('FAILED', 'En erreur'),
+    )
+
+    profile = models.ForeignKey(MakerScienceProfile, related_name='avatar_jobs')
+    upload = models.ImageField(upload_to='avatars/pending')
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='PENDING', db_index=True)
+    claimed_on = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Return the next jobs to process, switched to RUNNING so that an overlapping run skips them.
+        The jobs of a crashed run are claimed again once AVATAR_JOB_CLAIM_TIMEOUT has expired.
+        """
+        now = datetime.now()
+        with transaction.atomic():
+            jobs = list(cls.objects.select_for_update()
+                                   .select_related('profile__parent')
+                                   .filter(models.Q(status='PENDING') |
+                                           models.Q(status='RUNNING', claimed_on__lte=now - timedelta(seconds=AVATAR_JOB_CLAIM_TIMEOUT)))
+                                   .order_by('id')[:limit])
+            cls.objects.filter(id__in=[job.id for job in jobs]).update(status='RUNNING', claimed_on=now)
+        return jobs
+
+    def process(self):
+        try:
+            self.upload.open('rb')
+            content = self.upload.read()
+            self.upload.close()
+            avatar = MakerScienceAvatar.from_content(content, os.path.splitext(self.upload.name)[1].lower())
+
+            user_profile = self.profile.parent
+            old_mugshot = user_profile.mugshot.name if user_profile.mugshot else None
+
+            MakerScienceProfile.objects.filter(id=self.profile_id).update(avatar=avatar)
+            user_profile.mugshot = avatar.original.name
+            user_profile.save()
+
+            # Avatars are shared between profiles, only legacy uploads are owned by the profile
+            if old_mugshot and old_mugshot != avatar.original.name \
+                    and not MakerScienceAvatar.objects.filter(original=old_mugshot).exists():
+                user_profile.mugshot.storage.delete(old_mugshot)
+
+            self.upload.delete(save=False)
+            self.status = 'DONE'
+        except Exception:
+            self.status = 'FAILED'
+            self.error = traceback.format_exc()
+        self.save()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from tastypie.models import ApiKey
+from taggit.models import Tag
+
+from accounts.models import Profile
+
+from makerscience_admin.sqlstats import SQL_QUERY_BUDGETS, capture_queries, query_budget
+
+from .models import MakerScienceProfile, MakerScienceProfileTaggedItem
+
+
+class ProfileQueryPlanTest(TestCase):
+    """
+    The query plans of get_object_list must keep the number of queries
+    independent of the number of profiles and tags returned
+    """
+    def setUp(self):
+        # Superusers skip the per-object permission queries of can_edit
+        admin = User.objects.create_superuser('admin', 'admin@makerscience.fr', 'admin')
+        api_key, created = ApiKey.objects.get_or_create(user=admin)
+        self.params = {'format' : 'json', 'username' : admin.username, 'api_key' : api_key.key}
+        self.created = 0
+
+    def create_profile(self, tags=2):
+        self.created += 1
+        user = User.objects.create_user('member%s' % self.created, 'member%s@makerscience.fr' % self.created, 'member')
+        user.first_name = 'Member'
+        user.last_name = str(self.created)
+        user.save()
+        profile, created = Profile.objects.get_or_create(user=user)
+        ms_profile = MakerScienceProfile.objects.get(parent=profile)
+        for i in range(tags):
+            MakerScienceProfileTaggedItem.objects.create(content_object=ms_profile,
+                                                         tag=Tag.objects.create(name='tag-%s-%s' % (self.created, i)),
+                                                         tag_type='SK')
+        return ms_profile
+
+    def count_queries(self, url, **params):
+        with capture_queries() as stats:
+            response = self.client.get(url, dict(self.params, **params))
+        self.assertEqual(response.status_code, 200)
+        return stats.count
+
+    def budget(self, resource_name):
+        # Each resource is held to its own budget, not to the default one
+        self.assertIn(resource_name, SQL_QUERY_BUDGETS)
+        return query_budget(resource_name)
+
+    def assertListQueriesConstant(self, resource_name):
+        url = '/api/v0/%s/' % resource_name
+        self.create_profile()
+        self.count_queries(url, limit=20) # content types and api key lookups are cached after the first request
+        few = self.count_queries(url, limit=20)
+        for i in range(4):
+            self.create_profile(tags=3)
+        many = self.count_queries(url, limit=20)
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, self.budget(resource_name))
+
+    def assertDetailQueriesConstant(self, resource_name):
+        url = '/api/v0/%s/%s/'
+        untagged = self.create_profile(tags=0)
+        tagged = self.create_profile(tags=3)
+        self.count_queries(url % (resource_name, untagged.slug))
+        few = self.count_queries(url % (resource_name, untagged.slug))
+        self.count_queries(url % (resource_name, tagged.slug))
+        many = self.count_queries(url % (resource_name, tagged.slug))
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, self.budget(resource_name))
+
+    def test_profile_list(self):
+        self.assertListQueriesConstant('makerscience/profile')
+
+    def test_profile_detail(self):
+        self.assertDetailQueriesConstant('makerscience/profile')
+
+    def test_profilelight_list(self):
+        self.assertListQueriesConstant('makerscience/profilelight')
+
+    def test_profilelight_detail(self):
+        self.assertDetailQueriesConstant('makerscience/profilelight')
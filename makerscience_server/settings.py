@@ -79,6 +79,9 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'makerscience_admin.middleware.SQLInstrumentationMiddleware',
+    'makerscience_admin.middleware.MetricsMiddleware',
+
     'corsheaders.middleware.CorsMiddleware',
     'corsheaders.middleware.CorsPostCsrfMiddleware',
 
@@ -92,6 +95,7 @@ MIDDLEWARE_CLASSES = (
     'simple_history.middleware.HistoryRequestMiddleware',
 
     'makerscience_admin.middleware.PageViewsMiddleware',
+    'makerscience_admin.middleware.ProfilerMiddleware',
 
 )
 
@@ -197,6 +201,10 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler'
         }
     },
     'loggers': {
@@ -205,6 +213,14 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'makerscience.sql': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'makerscience.pageviews': {
+            'handlers': ['console', 'mail_admins'],
+            'level': 'WARNING',
+        },
     }
 }
 
@@ -233,6 +249,30 @@ CORS_ORIGIN_ALLOW_ALL = False
 CORS_REPLACE_HTTPS_REFERER = True
 
 TASTYPIE_FULL_DEBUG = DEBUG
+
+# Clients allowed to read /metrics/
+METRICS_ALLOWED_IPS = ('127.0.0.1',)
+# Seconds between two additions of the counters of a process to the shared cache
+METRICS_FLUSH_INTERVAL = 10
+
+# CACHES must be shared by every process (memcached, redis) in site_settings, the startup fails
+# otherwise (see makerscience_admin.caching). Single process development setups can set
+# LOCAL_CACHE_ALLOWED = True in site_settings instead.
+LOCAL_CACHE_ALLOWED = globals().get('LOCAL_CACHE_ALLOWED', False)
+
+# Each waiting live notification request (makerscience_notification.live) holds a worker thread
+LIVE_NOTIFICATION_MAX_WAITERS = 8
+
+# Maximum number of SQL queries per tastypie resource name, see makerscience_admin.sqlstats
+SQL_QUERY_BUDGETS = {
+    'makerscience/project' : 40,
+    'makerscience/resource' : 40,
+    'makerscience/post' : 30,
+    'makerscience/profile' : 30,
+    'makerscience/profilelight' : 15,
+    'notification' : 10,
+    'makerscience/static' : 5,
+}
 APPEND_SLASH = False
 TASTYPIE_ALLOW_MISSING_SLASH = True
 TASTYPIE_DEFAULT_FORMATS = ['json']
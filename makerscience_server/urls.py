@@ -102,6 +102,7 @@ urlpatterns = patterns('',
     url(r'^bucket/', include('bucket.urls')),
     url(r'^getimg/', 'makerscience_catalog.views.parse_html_img'),
     url(r'^geturl/', 'makerscience_catalog.views.parse_url_link'),
+    url(r'^metrics/$', 'makerscience_admin.views.metrics'),
 )
 
 if settings.DEBUG: